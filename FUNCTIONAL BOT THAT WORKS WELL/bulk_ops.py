@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import time
+import discord
+
+# Most guild-changing API calls in flight at once across all routes
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '8'))
+# Most calls in flight on one route, e.g. channel creation
+BULK_ROUTE_CONCURRENCY = int(os.getenv('BULK_ROUTE_CONCURRENCY', '3'))
+# Times one operation is retried after a rate limit or server error
+BULK_MAX_RETRIES = int(os.getenv('BULK_MAX_RETRIES', '5'))
+# Seconds between checkpoint writes while a long bulk run is in progress
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', '1'))
+
+
+class BulkOperation:
+    def __init__(self, key, route, description, action, depends_on=()):
+        self.key = key
+        self.route = route
+        self.description = description
+        self.action = action
+        self.depends_on = tuple(depends_on)
+
+
+class RouteBudget:
+    """Concurrency cap and shared pause for one API route."""
+
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0
+
+    async def wait(self):
+        delay = self.resume_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, delay):
+        self.resume_at = max(self.resume_at, asyncio.get_running_loop().time() + delay)
+
+
+def retry_delay(error, attempt):
+    # Seconds to wait before retrying, None when the error is not worth retrying
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if isinstance(error, discord.HTTPException) and (error.status == 429 or error.status >= 500):
+        return getattr(error, 'retry_after', None) or 2 ** attempt
+    return None
+
+
+class BulkCheckpoint:
+    """The targets of a bulk run and the keys already finished, kept on disk so an interrupted run resumes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.targets = None
+        self.completed = set()
+        self.last_save = 0
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            self.targets = state["targets"]
+            self.completed = set(state["completed"])
+
+    def mark(self, key):
+        self.completed.add(key)
+        if time.monotonic() - self.last_save >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({"targets": self.targets, "completed": sorted(self.completed)}, f)
+        os.replace(temp_path, self.path)
+        self.last_save = time.monotonic()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def reset(self):
+        """Forget the saved run, so the next one starts over."""
+        self.clear()
+        self.targets = None
+        self.completed = set()
+
+
+class BulkExecutor:
+    """Runs guild operations concurrently while keeping dependency order.
+
+    Every operation's action is called with the results of finished operations,
+    keyed by operation key, so a channel can use the category created for it.
+    Operations whose dependency failed are skipped. A 429 pauses only the route
+    it came from. on_progress, if given, is awaited after every finished operation.
+    Executors for different guilds can share one semaphore as a global cap. With
+    a checkpoint, every finished operation's key is recorded in it.
+    """
+
+    def __init__(self, concurrency=BULK_CONCURRENCY, route_concurrency=BULK_ROUTE_CONCURRENCY,
+                 max_retries=BULK_MAX_RETRIES, on_progress=None, semaphore=None, checkpoint=None):
+        self.semaphore = semaphore or asyncio.Semaphore(concurrency)
+        self.checkpoint = checkpoint
+        self.route_concurrency = route_concurrency
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self.routes = {}
+        self.operations = {}
+        self.results = {}
+        self.failed = []
+        self.skipped = []
+        self.done = 0
+
+    def add(self, key, route, description, action, depends_on=()):
+        self.operations[key] = BulkOperation(key, route, description, action, depends_on)
+
+    @property
+    def total(self):
+        return len(self.operations)
+
+    async def run(self):
+        tasks = {}
+
+        async def run_operation(operation):
+            ok = True
+            for dependency in operation.depends_on:
+                if dependency in tasks and not await tasks[dependency]:
+                    self.skipped.append(operation.description)
+                    ok = False
+                    break
+            if ok:
+                ok = await self.attempt(operation)
+            self.done += 1
+            if self.on_progress:
+                await self.on_progress(self)
+            return ok
+
+        for key, operation in self.operations.items():
+            tasks[key] = asyncio.ensure_future(run_operation(operation))
+        await asyncio.gather(*tasks.values())
+        return self
+
+    async def attempt(self, operation):
+        budget = self.routes.setdefault(operation.route, RouteBudget(self.route_concurrency))
+        attempt = 0
+        while True:
+            async with budget.semaphore:
+                # A paused route waits without holding one of the global slots
+                await budget.wait()
+                async with self.semaphore:
+                    try:
+                        self.results[operation.key] = await operation.action(self.results)
+                        if self.checkpoint:
+                            self.checkpoint.mark(operation.key)
+                        return True
+                    except Exception as e:
+                        error = e
+                delay = retry_delay(error, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    self.failed.append((operation.description, error))
+                    return False
+                attempt += 1
+                budget.backoff(delay)
+
+    def summary(self, verb):
+        succeeded = self.total - len(self.failed) - len(self.skipped)
+        lines = [f'{verb} {succeeded}/{self.total} items.']
+        if self.failed:
+            failures = [f'{description}: {str(error)[:100]}' for description, error in self.failed]
+            lines.append(f'Failed ({len(failures)}): ' + '; '.join(failures[:10]) + (' ...' if len(failures) > 10 else ''))
+        if self.skipped:
+            lines.append(f'Skipped because a dependency failed ({len(self.skipped)}): '
+                         + ', '.join(self.skipped[:10]) + (' ...' if len(self.skipped) > 10 else ''))
+        return '\n'.join(lines)
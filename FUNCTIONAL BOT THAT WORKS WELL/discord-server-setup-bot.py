@@ -2,9 +2,17 @@ import discord
 from discord.ext import commands
 import os
 import json
+import re
+import asyncio
+import heapq
 from datetime import datetime
 import importlib.util
 from dotenv import load_dotenv
+from message_archive import MessageArchive
+from message_whitelist import WHITELIST_VERSION, compile_whitelist, migrate_whitelist, split_formats
+from log_export import EXPORT_FORMATS, LogExportWriter, export_extension
+from bulk_ops import BulkCheckpoint, BulkExecutor
+from server_plan import ConfigError, compile_template, plan_server
 
 # Load environment variables
 load_dotenv()
@@ -16,36 +24,101 @@ intents.members = True
 
 bot = commands.Bot(command_prefix='!', intents=intents)
 
-# File to store all persistent data
+# Legacy single file holding every guild's data, only read to migrate guilds into shards
 DATA_FILE = os.getenv('DATA_FILE', 'bot_data.json')
-
-# Load data from file
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
+# Directory holding one JSON shard per guild
+DATA_DIR = os.getenv('DATA_DIR', 'bot_data')
+# Seconds to wait so a burst of updates to a guild becomes one write
+SAVE_DELAY = float(os.getenv('SAVE_DELAY', '2'))
+# Most channel/thread histories !log_tagged fetches at the same time
+LOG_CONCURRENCY = int(os.getenv('LOG_CONCURRENCY', '4'))
+# Times one history crawl is retried after being rate limited
+LOG_MAX_RETRIES = int(os.getenv('LOG_MAX_RETRIES', '5'))
+# Seconds between edits of the !log_tagged status message
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '3'))
+# Pages of history (100 messages each) buffered per channel ahead of the merge
+LOG_BUFFER_PAGES = int(os.getenv('LOG_BUFFER_PAGES', '2'))
+# Most API calls in flight across all guilds while !apply_template rolls a template out
+TEMPLATE_CONCURRENCY = int(os.getenv('TEMPLATE_CONCURRENCY', '16'))
+# SQLite file archiving tagged channels as messages arrive, so logs rarely hit the API; empty to disable
+ARCHIVE_FILE = os.getenv('ARCHIVE_FILE', '')
+
+# Guild shards loaded so far, filled lazily by get_guild_data
+bot_data = {}
+legacy_data = None
+dirty_guilds = set()
+save_task = None
+
+archive = MessageArchive(ARCHIVE_FILE) if ARCHIVE_FILE else None
+# First message captured live per channel since the gateway connected; the archive is complete from there on
+archive_live_since = {}
+# Compiled message whitelist per guild, dropped whenever the whitelist changes
+whitelist_matchers = {}
+
+def shard_path(guild_id):
+    return os.path.join(DATA_DIR, f'{guild_id}.json')
+
+# Load one guild's data from its shard, falling back to the legacy file
+def load_data(guild_id):
+    global legacy_data
+    path = shard_path(guild_id)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
             return json.load(f)
-    return {}
-
-# Save data to file
-def save_data():
-    with open(DATA_FILE, 'w') as f:
-        json.dump(bot_data, f)
-
-# Load initial data
-bot_data = load_data()
+    if legacy_data is None:
+        legacy_data = {}
+        if os.path.exists(DATA_FILE):
+            with open(DATA_FILE, 'r') as f:
+                legacy_data = json.load(f)
+    return legacy_data.get(guild_id)
+
+# Mark a guild's data as changed; the shard is written shortly after in the background
+def save_data(guild_id):
+    global save_task
+    dirty_guilds.add(str(guild_id))
+    if save_task is None or save_task.done():
+        save_task = asyncio.create_task(flush_data())
+
+async def flush_data():
+    await asyncio.sleep(SAVE_DELAY)
+    while dirty_guilds:
+        guild_id = dirty_guilds.pop()
+        # Serialize on the loop so the worker thread never sees a dict being mutated.
+        # A purged guild is written as a null tombstone so load_data does not fall back to the legacy file
+        payload = json.dumps(bot_data.get(guild_id))
+        try:
+            await asyncio.to_thread(write_shard, guild_id, payload)
+        except OSError as e:
+            print(f"Failed to save data for guild {guild_id}: {e}")
+
+def write_shard(guild_id, payload):
+    path = shard_path(guild_id)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
 
 def get_guild_data(guild_id):
-    if str(guild_id) not in bot_data:
-        bot_data[str(guild_id)] = {
+    guild_id = str(guild_id)
+    if guild_id not in bot_data:
+        # A guild waiting to be flushed was just cleared, its old shard is stale
+        stored = load_data(guild_id) if guild_id not in dirty_guilds else None
+        bot_data[guild_id] = migrate_whitelist(stored) if stored else {
             "registered_aliases": {},
             "channel_tags": {},
-            "message_whitelist": []
+            "message_whitelist": [],
+            "whitelist_version": WHITELIST_VERSION
         }
-    return bot_data[str(guild_id)]
+    return bot_data[guild_id]
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
+    # Messages sent while disconnected were missed, so live capture starts over
+    archive_live_since.clear()
     await load_extensions()
     
 
@@ -97,69 +170,196 @@ async def reload_extensions(ctx):
                 await ctx.send(f'Failed to reload extension {filename[:-3]}')
                 await ctx.send(f'Error: {str(e)}')
 
-@bot.command(name='setup_server', help='Sets up the server based on the provided configuration file')
+@bot.command(name='setup_server', help='Brings the server in line with the configuration file, creating or editing only what differs. '
+                                       'Use --dry-run to list the changes without making them, --prune to also delete what the file does not mention')
 @commands.has_permissions(administrator=True)
-async def setup_server(ctx):
+async def setup_server(ctx, *options: str):
     if not os.path.exists('server_config.txt'):
         await ctx.send("Could not find server_config.txt file.")
         return
 
-    with open('server_config.txt', 'r') as file:
-        current_category = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('CATEGORY:'):
-                category_name = line[9:].strip()
-                current_category = await ctx.guild.create_category(category_name)
-            elif line.startswith('CHANNEL:'):
-                if current_category is None:
-                    await ctx.send("Error: Channel specified without a category.")
-                    return
-                channel_info = line[8:].strip().split('|')
-                channel_name = channel_info[0].strip()
-                channel_topic = channel_info[1].strip() if len(channel_info) > 1 else ""
-                await ctx.guild.create_text_channel(channel_name, category=current_category, topic=channel_topic)
-            elif line.startswith('ROLE:'):
-                role_info = line[5:].strip().split(',')
-                role_name = role_info[0].strip()
-                color = discord.Colour(int(role_info[1].strip(), 16)) if len(role_info) > 1 else discord.Colour.default()
-                permissions = discord.Permissions()
-                for perm in role_info[2:]:
-                    perm = perm.strip()
-                    if hasattr(permissions, perm):
-                        setattr(permissions, perm, True)
-                await ctx.guild.create_role(name=role_name, color=color, permissions=permissions)
-
-    await ctx.send("Server setup complete!")
-
-@bot.command(name='purge_server', help='Purges all categories, channels, and roles from the server')
+    try:
+        config = compile_template('server_config.txt')
+    except ConfigError as e:
+        await ctx.send("Error: " + "\n".join(e.errors))
+        return
+    plan = plan_server(config, ctx.guild, prune='--prune' in options)
+
+    if '--dry-run' in options or not plan.changes:
+        lines = [change.describe() for change in plan.changes]
+        listing = '\n'.join(lines[:40]) + (f'\n... and {len(lines) - 40} more' if len(lines) > 40 else '')
+        await ctx.send(f'Plan: {plan.summary()}' + (f'\n{listing}' if listing else ''))
+        return
+
+    executor = BulkExecutor()
+    plan.add_to(executor)
+    status = await ctx.send(f'Applying {executor.total} changes: {plan.summary()}...')
+    executor.on_progress = BulkProgress(status, 'Setting up')
+    await executor.run()
+    await executor.on_progress(executor, force=True)
+    await ctx.send("Server setup complete!" if not executor.failed and not executor.skipped else executor.summary('Applied'))
+
+@bot.command(name='apply_template', help='Applies a template file (server_config.txt, input.txt or roles.txt format) to several guilds at once. '
+                                         'Pass guild IDs or "all" for every guild where you are an administrator; --dry-run and --prune work as in setup_server')
+@commands.has_permissions(administrator=True)
+async def apply_template(ctx, template: str, *targets: str):
+    # Only plain file names from the bot's working directory
+    if os.path.basename(template) != template or not os.path.exists(template):
+        await ctx.send(f"Could not find template file {template}.")
+        return
+    try:
+        config = compile_template(template)
+    except ConfigError as e:
+        await ctx.send("Error: " + "\n".join(e.errors))
+        return
+
+    options = [target for target in targets if target.startswith('--')]
+    guild_ids = [target for target in targets if not target.startswith('--')]
+    if guild_ids == ['all']:
+        guilds = list(bot.guilds)
+    else:
+        guilds = []
+        for guild_id in guild_ids:
+            guild = bot.get_guild(int(guild_id)) if guild_id.isdigit() else None
+            if guild is None:
+                await ctx.send(f"Not a guild this bot is in: {guild_id}")
+                return
+            guilds.append(guild)
+    # The caller must be an administrator in every guild the template touches
+    guilds = [
+        guild for guild in guilds
+        if (member := guild.get_member(ctx.author.id)) is not None and member.guild_permissions.administrator
+    ]
+    if not guilds:
+        await ctx.send("No guilds to apply the template to.")
+        return
+
+    plans = [(guild, plan_server(config, guild, prune='--prune' in options)) for guild in guilds]
+    if '--dry-run' in options:
+        await ctx.send('\n'.join(f'{guild.name}: {plan.summary()}' for guild, plan in plans))
+        return
+
+    semaphore = asyncio.Semaphore(TEMPLATE_CONCURRENCY)
+    executors = []
+    for guild, plan in plans:
+        executor = BulkExecutor(semaphore=semaphore)
+        plan.add_to(executor)
+        executors.append(executor)
+    status = await ctx.send(f'Applying {template} to {len(guilds)} guilds ({sum(e.total for e in executors)} changes)...')
+    progress = BulkProgress(status, f'Applying {template}')
+    total = TemplateRollout(executors)
+
+    async def report(executor):
+        await progress(total)
+
+    for executor in executors:
+        executor.on_progress = report
+    await asyncio.gather(*(executor.run() for executor in executors))
+    await progress(total, force=True)
+    await ctx.send('\n'.join(
+        f'{guild.name}: ' + ('up to date' if not executor.failed and not executor.skipped else executor.summary('Applied'))
+        for (guild, plan), executor in zip(plans, executors)
+    ))
+
+class TemplateRollout:
+    """Combined done/total/failed counts of several executors, for BulkProgress."""
+
+    def __init__(self, executors):
+        self.executors = executors
+
+    @property
+    def done(self):
+        return sum(executor.done for executor in self.executors)
+
+    @property
+    def total(self):
+        return sum(executor.total for executor in self.executors)
+
+    @property
+    def failed(self):
+        return [failure for executor in self.executors for failure in executor.failed]
+
+@bot.command(name='purge_server', help='Purges all categories, channels, and roles from the server. An interrupted purge resumes where it stopped; '
+                                       'use --restart to discard its checkpoint and start over')
 @commands.has_permissions(administrator=True)
-async def purge_server(ctx):
+async def purge_server(ctx, *options: str):
     guild = ctx.guild
 
-    for category in guild.categories:
-        await category.delete()
-    for channel in guild.channels:
-        if isinstance(channel, discord.TextChannel):
-            await channel.delete()
+    # The target IDs are fixed up front and every deletion is checkpointed, so a rerun only deletes what is left
+    checkpoint = BulkCheckpoint(os.path.join(DATA_DIR, f'purge_{guild.id}.json'))
+    if '--restart' in options:
+        checkpoint.reset()
+    resumed = checkpoint.targets is not None
+    current = {
+        "channels": [category.id for category in guild.categories]
+                    + [channel.id for channel in guild.channels if isinstance(channel, discord.TextChannel)],
+        "roles": [role.id for role in guild.roles if role.name != "@everyone" and role < guild.me.top_role]
+    }
+    if not resumed:
+        checkpoint.targets = current
+    else:
+        # Channels and roles created since the interrupted run are purged too
+        for kind, target_ids in current.items():
+            known = set(checkpoint.targets[kind])
+            checkpoint.targets[kind] += [target_id for target_id in target_ids if target_id not in known]
+    checkpoint.save()
+
+    executor = BulkExecutor(checkpoint=checkpoint)
+    for kind, get_target, route in (("channels", guild.get_channel, 'delete_channel'), ("roles", guild.get_role, 'delete_role')):
+        for target_id in checkpoint.targets[kind]:
+            key = f'{kind}:{target_id}'
+            if key in checkpoint.completed:
+                continue
+            target = get_target(target_id)
+            if target is None:
+                # Already deleted, by an earlier run or by hand
+                checkpoint.completed.add(key)
+                continue
+            executor.add(key, route, f'{kind[:-1]} {target.name}', lambda results, target=target: delete_purge_target(target))
 
-    for role in guild.roles:
-        if role.name != "@everyone" and role < guild.me.top_role:
-            await role.delete()
+    try:
+        status = await ctx.author.send(f'{"Resuming" if resumed else "Starting"} purge: {executor.total} items to delete...')
+        executor.on_progress = BulkProgress(status, 'Purging')
+    except discord.HTTPException:
+        pass
+    started = asyncio.get_running_loop().time()
+    await executor.run()
+    elapsed = asyncio.get_running_loop().time() - started
+    remaining = len(executor.failed) + len(executor.skipped)
+    if remaining:
+        checkpoint.save()
+    else:
+        checkpoint.clear()
 
     # Clear the data for this guild
-    if str(guild.id) in bot_data:
-        del bot_data[str(guild.id)]
-        save_data()
-
+    bot_data.pop(str(guild.id), None)
+    whitelist_matchers.pop(str(guild.id), None)
+    if legacy_data:
+        legacy_data.pop(str(guild.id), None)
+    save_data(guild.id)
+
+    deleted = executor.total - remaining
+    rate = f'{deleted / elapsed:.1f}/s' if elapsed > 0 else 'n/a'
+    if not remaining:
+        report = f"Server purge complete! Deleted {deleted} items in {elapsed:.1f}s ({rate})."
+    else:
+        report = (f"{executor.summary('Deleted')}\n{remaining} items remaining after {elapsed:.1f}s ({rate}). "
+                  f"Run !purge_server again to resume.")
     try:
-        await ctx.author.send("Server purge complete!")
+        await ctx.author.send(report)
     except discord.errors.Forbidden:
         remaining_channel = next((c for c in guild.text_channels), None)
         if remaining_channel:
-            await remaining_channel.send("Server purge complete!")
+            await remaining_channel.send(report)
         else:
-            print("Server purge complete, but couldn't notify the user.")
+            print(report)
+
+async def delete_purge_target(target):
+    try:
+        await target.delete()
+    except discord.NotFound:
+        # Someone else deleted it meanwhile, which is just as good
+        pass
 
 @bot.command(name='mark', help='Marks a channel with a tag')
 @commands.has_permissions(manage_channels=True)
@@ -170,7 +370,7 @@ async def mark_channel(ctx, tag: str):
         guild_data["channel_tags"][channel_id] = []
     if tag not in guild_data["channel_tags"][channel_id]:
         guild_data["channel_tags"][channel_id].append(tag)
-        save_data()
+        save_data(ctx.guild.id)
         await ctx.send(f'Channel marked with tag: {tag}')
     else:
         await ctx.send(f'Channel already marked with tag: {tag}')
@@ -182,12 +382,17 @@ async def unmark_channel(ctx, tag: str):
     channel_id = str(ctx.channel.id)
     if channel_id in guild_data["channel_tags"] and tag in guild_data["channel_tags"][channel_id]:
         guild_data["channel_tags"][channel_id].remove(tag)
-        save_data()
+        if not guild_data["channel_tags"][channel_id]:
+            # Untagged channels are not captured live, so a later tag has to sync the gap again
+            archive_live_since.pop(ctx.channel.id, None)
+        save_data(ctx.guild.id)
         await ctx.send(f'Tag {tag} removed from channel')
     else:
         await ctx.send(f'Tag {tag} not found for this channel')
 
-@bot.command(name='log_tagged', help='Logs messages from channels and threads with a specific tag, starting from the specified message IDs')
+@bot.command(name='log_tagged', help='Logs messages from channels and threads with a specific tag, starting from the specified message IDs. '
+                                     'Use --since-last to log only messages newer than the previous run (add --rotate to start a new file). '
+                                     'Use --format=jsonl for JSON lines and --gzip to compress the uploaded log')
 async def log_tagged_messages(ctx, tag: str, *message_ids: str):
     guild_data = get_guild_data(ctx.guild.id)
     tagged_channels = [channel_id for channel_id, tags in guild_data["channel_tags"].items() if tag in tags]
@@ -196,73 +401,456 @@ async def log_tagged_messages(ctx, tag: str, *message_ids: str):
         await ctx.send(f'No channels found with tag: {tag}')
         return
 
-    messages = []
+    since_last = '--since-last' in message_ids
+    rotate = '--rotate' in message_ids
+    compress = '--gzip' in message_ids
+    export_format = next((arg.split('=', 1)[1] for arg in message_ids if arg.startswith('--format=')), 'text')
+    if export_format not in EXPORT_FORMATS:
+        await ctx.send(f'Unknown log format: {export_format}. Use one of: {", ".join(EXPORT_FORMATS)}')
+        return
+    message_ids = [message_id for message_id in message_ids if not message_id.startswith('--')]
+    # Highest message ID logged so far for each channel and thread with this tag
+    cursors = guild_data.setdefault("log_cursors", {}).setdefault(tag, {})
+
+    start_ids = {}
     for i, channel_id in enumerate(tagged_channels):
         channel = ctx.guild.get_channel(int(channel_id))
-        if not channel:
-            continue
-
-        start_message_id = None
-        if i < len(message_ids):
+        if channel and not since_last and i < len(message_ids):
             try:
-                start_message_id = int(message_ids[i])
+                start_ids[channel.id] = int(message_ids[i])
             except ValueError:
                 await ctx.send(f'Invalid message ID provided for channel {channel.name}. Skipping start point for this channel.')
 
-        # Log messages from the main channel
-        await log_messages_from_channel(channel, start_message_id, messages, guild_data, ctx.guild.id)
-
-        # Log messages from threads in the channel
-        for thread in channel.threads:
-            await log_messages_from_channel(thread, None, messages, guild_data, ctx.guild.id)
-
-    messages.sort(key=lambda x: x[0])
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = f'{tag}_log_{timestamp}.txt'
-    with open(file_name, 'w', encoding='utf-8') as log_file:
-        for msg_time, channel_name, thread_name, author_name, content in messages:
-            if thread_name:
-                log_file.write(f'[{channel_name} > {thread_name}] {author_name}: {content}\n')
-            else:
-                log_file.write(f'[{channel_name}] {author_name}: {content}\n')
-
-    await ctx.send(f'Logged {len(messages)} messages with tag {tag} to {file_name}')
-
-async def log_messages_from_channel(channel, start_message_id, messages, guild_data, guild_id):
-    async for msg in channel.history(limit=None, oldest_first=True, after=discord.Object(id=start_message_id - 1) if start_message_id else None):
-        if msg.author != bot.user and is_valid_message_format(guild_id, msg.content):
-            thread_name = channel.name if isinstance(channel, discord.Thread) else None
-            channel_name = channel.parent.name if isinstance(channel, discord.Thread) else channel.name
-            messages.append((
-                msg.created_at,
-                channel_name,
-                thread_name,
-                get_registered_alias(guild_id, msg.author),
-                msg.content
-            ))
-
-@bot.command(name='set_whitelist', help='Sets the message format whitelist')
+    limiter = CrawlLimiter(LOG_CONCURRENCY)
+    # Log messages from the main channels and from their active and archived threads
+    targets = await tagged_targets(ctx.guild, tagged_channels, limiter)
+    status = await ctx.send(f'Logging {len(targets)} channels and threads with tag {tag}...')
+    progress = CrawlProgress(status, len(targets))
+    queues = [asyncio.Queue(maxsize=LOG_BUFFER_PAGES) for _ in targets]
+    new_cursors = {}
+    crawlers = []
+    for (channel, parent, thread_name), queue in zip(targets, queues):
+        if since_last:
+            start_message_id = next_cursor_start(cursors, channel.id)
+        else:
+            start_message_id = start_ids.get(channel.id)
+        crawlers.append(asyncio.create_task(log_messages_from_channel(
+            channel, parent, thread_name, start_message_id, queue, ctx.guild.id, limiter, progress, new_cursors
+        )))
+
+    # A --since-last run appends to the tag's previous log unless asked to rotate or the format changed
+    log_files = guild_data.setdefault("log_files", {})
+    extension = export_extension(export_format, compress)
+    file_name = log_files.get(tag)
+    append = since_last and not rotate and file_name and file_name.endswith(extension) and os.path.exists(file_name)
+    if not append:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_name = f'{tag}_log_{timestamp}{extension}'
+    # Chunks are cut below the guild's upload limit so each one can be sent as an attachment
+    writer = LogExportWriter(file_name, export_format, compress, ctx.guild.filesize_limit, append=append)
+    try:
+        with writer:
+            async for entry in merge_channel_logs(queues):
+                writer.write(*entry)
+    finally:
+        for crawler in crawlers:
+            crawler.cancel()
+    await progress.update(force=True)
+
+    cursors.update(new_cursors)
+    log_files[tag] = writer.paths[-1]
+    save_data(ctx.guild.id)
+
+    parts = f' ({len(writer.paths)} parts)' if len(writer.paths) > 1 else ''
+    await ctx.send(f'Logged {writer.lines} {"new " if since_last else ""}messages with tag {tag} to {writer.paths[0]}{parts}')
+    if progress.failed:
+        await ctx.send(f'Could not read: {", ".join(progress.failed)}')
+    await upload_log_files(ctx, writer.paths)
+
+async def upload_log_files(ctx, paths):
+    # One attachment per message, each chunk is already under the upload limit
+    for path in paths:
+        try:
+            await ctx.send(file=discord.File(path))
+        except discord.HTTPException as e:
+            await ctx.send(f'Could not upload {os.path.basename(path)}: {e}')
+
+class CrawlLimiter:
+    """Caps concurrent history crawls and pauses all of them after a rate limit."""
+
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0
+
+    async def wait(self):
+        delay = self.resume_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, delay):
+        self.resume_at = max(self.resume_at, asyncio.get_running_loop().time() + delay)
+
+class CrawlProgress:
+    """Reports crawl progress by editing one status message, at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, message, total):
+        self.message = message
+        self.total = total
+        self.done = 0
+        self.fetched = 0
+        self.failed = []
+        self.last_edit = 0
+
+    async def update(self, force=False):
+        now = asyncio.get_running_loop().time()
+        if not force and now - self.last_edit < PROGRESS_INTERVAL:
+            return
+        self.last_edit = now
+        try:
+            await self.message.edit(content=f'Logging: {self.done}/{self.total} channels and threads done, {self.fetched} messages read')
+        except discord.HTTPException:
+            pass
+
+class BulkProgress:
+    """Reports BulkExecutor progress by editing one status message, at most every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, message, verb):
+        self.message = message
+        self.verb = verb
+        self.last_edit = 0
+
+    async def __call__(self, executor, force=False):
+        now = asyncio.get_running_loop().time()
+        if not force and now - self.last_edit < PROGRESS_INTERVAL:
+            return
+        self.last_edit = now
+        try:
+            await self.message.edit(content=f'{self.verb}: {executor.done}/{executor.total} done, {len(executor.failed)} failed')
+        except discord.HTTPException:
+            pass
+
+def next_cursor_start(cursors, channel_id):
+    # First message ID a --since-last run should log for a channel, None to log it all
+    cursor = cursors.get(str(channel_id))
+    return cursor + 1 if cursor else None
+
+def rate_limit_delay(error, attempt):
+    # Seconds to back off for a rate limit error, None for any other error
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if isinstance(error, discord.HTTPException) and error.status == 429:
+        return getattr(error, 'retry_after', None) or 2 ** attempt
+    return None
+
+async def limited_fetch(limiter, fetch):
+    # Runs one paged API fetch; the semaphore bounds requests in flight, not channels
+    attempt = 0
+    while True:
+        async with limiter.semaphore:
+            await limiter.wait()
+            try:
+                return await fetch()
+            except (discord.RateLimited, discord.HTTPException) as e:
+                delay = rate_limit_delay(e, attempt)
+                if delay is None or attempt >= LOG_MAX_RETRIES:
+                    raise
+                attempt += 1
+                limiter.backoff(delay)
+
+async def fetch_history_page(channel, after, limiter):
+    # One page of history, oldest first
+    async def fetch():
+        return [msg async for msg in channel.history(limit=100, oldest_first=True, after=after)]
+    return await limited_fetch(limiter, fetch)
+
+async def fetch_archived_threads_page(channel, before, private, limiter):
+    # One page of archived threads, most recently archived first
+    async def fetch():
+        return [thread async for thread in channel.archived_threads(limit=100, before=before, private=private)]
+    return await limited_fetch(limiter, fetch)
+
+async def channel_threads(channel, limiter):
+    """Active and archived threads of a channel as {thread_id: name}.
+
+    Archived threads come newest-archived first, so paging stops once it reaches the
+    newest archive time seen by the previous run and the rest comes from the cache.
+    """
+    guild_data = get_guild_data(channel.guild.id)
+    cache = guild_data.setdefault("thread_cache", {}).setdefault(str(channel.id), {"threads": {}, "archived_until": {}})
+    threads = cache["threads"]
+    for kind in ('public', 'private'):
+        archived_until = cache["archived_until"].get(kind)
+        newest = None
+        before = None
+        try:
+            while True:
+                page = await fetch_archived_threads_page(channel, before, kind == 'private', limiter)
+                for thread in page:
+                    threads[str(thread.id)] = thread.name
+                if not page:
+                    break
+                newest = newest or page[0].archive_timestamp.isoformat()
+                before = page[-1].archive_timestamp
+                if len(page) < 100 or (archived_until and before.isoformat() <= archived_until):
+                    break
+        except discord.Forbidden:
+            # Listing private threads needs Manage Threads
+            continue
+        except discord.HTTPException as e:
+            print(f"Could not list archived threads of {channel.name}, using the cached list: {e}")
+            continue
+        if newest:
+            cache["archived_until"][kind] = newest
+    for thread in channel.threads:
+        threads[str(thread.id)] = thread.name
+    save_data(channel.guild.id)
+    return threads
+
+async def tagged_targets(guild, channel_ids, limiter):
+    # (channel or thread, parent channel, thread name) for each channel and every thread in it
+    channels = [channel for channel in (guild.get_channel(int(channel_id)) for channel_id in channel_ids) if channel]
+    thread_lists = await asyncio.gather(*(channel_threads(channel, limiter) for channel in channels))
+    targets = []
+    for channel, threads in zip(channels, thread_lists):
+        targets.append((channel, channel, None))
+        for thread_id, name in threads.items():
+            # Archived threads are not cached by the client, but their history only needs the ID
+            thread = guild.get_thread(int(thread_id)) or bot.get_partial_messageable(int(thread_id), guild_id=guild.id)
+            targets.append((thread, channel, name))
+    return targets
+
+def message_row(msg):
+    # Same shape as the rows MessageArchive.page returns
+    return (msg.id, msg.author.id, msg.author.name, msg.created_at, msg.content)
+
+async def read_history_page(channel, after_id, limiter):
+    # One page of rows after after_id, from the archive when enabled and from the API otherwise
+    if archive is not None:
+        return archive.page(channel.id, after_id)
+    page = await fetch_history_page(channel, discord.Object(id=after_id) if after_id else None, limiter)
+    return [message_row(msg) for msg in page]
+
+async def sync_archive(channel, limiter, progress=None, parent_id=None):
+    # Fetch the gap between the archive's synced_through mark and the start of live capture.
+    # SQLite writes run in a thread so a long backfill does not block the event loop
+    synced_through = await asyncio.to_thread(archive.synced_through, channel.id)
+    live_since = archive_live_since.get(channel.id)
+    if live_since is None or synced_through < live_since - 1:
+        after = discord.Object(id=synced_through) if synced_through else None
+        while True:
+            page = await fetch_history_page(channel, after, limiter)
+            reached_live = live_since is not None and any(msg.id >= live_since for msg in page)
+            done = len(page) < 100 or reached_live
+            if reached_live:
+                page = [msg for msg in page if msg.id < live_since]
+            if page:
+                await asyncio.to_thread(archive.store, page, parent_id)
+                await asyncio.to_thread(archive.set_synced_through, channel.id, page[-1].id)
+                synced_through = page[-1].id
+                after = page[-1]
+                if progress:
+                    progress.fetched += len(page)
+            if done:
+                break
+        if live_since is None:
+            # The archive now holds everything up to here, and anything newer is captured live
+            # while connected, so later runs skip the API until the next reconnect
+            live_since = archive_live_since.setdefault(channel.id, synced_through + 1)
+    # Everything from live_since on was captured as it arrived
+    latest_id = await asyncio.to_thread(archive.latest_id, channel.id)
+    await asyncio.to_thread(archive.set_synced_through, channel.id, max(latest_id, live_since - 1))
+
+async def log_messages_from_channel(channel, parent, thread_name, start_message_id, queue, guild_id, limiter, progress, cursors):
+    # Puts pages of log entries on queue in chronological order, then None when done
+    after_id = start_message_id - 1 if start_message_id else None
+    channel_name = parent.name
+    aliases = get_guild_data(guild_id)["registered_aliases"]
+    try:
+        if archive is not None:
+            await sync_archive(channel, limiter, parent_id=parent.id if thread_name else None)
+        while True:
+            page = await read_history_page(channel, after_id, limiter)
+            if not page:
+                break
+            after_id = page[-1][0]
+            progress.fetched += len(page)
+            await queue.put([
+                (created_at, channel_name, thread_name, aliases.get(str(author_id), author_name), content, message_id)
+                for message_id, author_id, author_name, created_at, content in page
+                if author_id != bot.user.id and is_valid_message_format(guild_id, content)
+            ])
+            cursors[str(channel.id)] = after_id
+            await progress.update()
+            if len(page) < 100:
+                break
+    except Exception as e:
+        # Any failure must still end this channel's stream, or the merge would wait forever
+        if isinstance(e, discord.NotFound) and thread_name:
+            # The thread was deleted, stop listing it on later runs
+            get_guild_data(guild_id)["thread_cache"][str(parent.id)]["threads"].pop(str(channel.id), None)
+        elif not isinstance(e, (discord.RateLimited, discord.HTTPException)):
+            print(f"An error occurred while logging {channel_name}: {e}")
+        progress.failed.append(f'{channel_name} > {thread_name}' if thread_name else channel_name)
+    progress.done += 1
+    await queue.put(None)
+
+async def merge_channel_logs(queues):
+    """Heap-based k-way merge of the per-channel page queues, yielding entries oldest first.
+
+    Only the head entry of each channel plus its buffered pages are held in memory.
+    """
+    pages = [[] for _ in queues]
+
+    async def next_entry(index):
+        while not pages[index]:
+            page = await queues[index].get()
+            if page is None:
+                return None
+            # Reversed so entries are popped from the end in chronological order
+            pages[index] = page[::-1]
+        return pages[index].pop()
+
+    heap = []
+    for index in range(len(queues)):
+        entry = await next_entry(index)
+        if entry is not None:
+            heapq.heappush(heap, (entry[0], index, entry))
+    while heap:
+        _, index, entry = heapq.heappop(heap)
+        yield entry
+        entry = await next_entry(index)
+        if entry is not None:
+            heapq.heappush(heap, (entry[0], index, entry))
+
+def is_tagged_channel(channel):
+    # True for a channel with any tag, or a thread inside one
+    channel_tags = get_guild_data(channel.guild.id)["channel_tags"]
+    parent_id = getattr(channel, 'parent_id', None)
+    return bool(channel_tags.get(str(channel.id)) or (parent_id and channel_tags.get(str(parent_id))))
+
+@bot.listen('on_message')
+async def archive_message(msg):
+    if archive is None or msg.guild is None or not is_tagged_channel(msg.channel):
+        return
+    archive.store([msg])
+    archive_live_since.setdefault(msg.channel.id, msg.id)
+
+@bot.listen('on_raw_message_edit')
+async def archive_message_edit(payload):
+    # Raw events also cover messages that are no longer in the client's cache
+    if archive is not None and 'content' in payload.data:
+        archive.edit(payload.channel_id, payload.message_id, payload.data['content'])
+
+@bot.listen('on_raw_message_delete')
+async def archive_message_delete(payload):
+    if archive is not None:
+        archive.delete(payload.channel_id, payload.message_id)
+
+@bot.listen('on_raw_bulk_message_delete')
+async def archive_bulk_message_delete(payload):
+    if archive is not None:
+        for message_id in payload.message_ids:
+            archive.delete(payload.channel_id, message_id)
+
+@bot.command(name='archive_backfill', help='Copies the history of channels and threads with a tag into the local message archive')
+@commands.has_permissions(administrator=True)
+async def archive_backfill(ctx, tag: str):
+    if archive is None:
+        await ctx.send('The message archive is disabled. Set ARCHIVE_FILE to enable it.')
+        return
+    guild_data = get_guild_data(ctx.guild.id)
+    tagged_channels = [channel_id for channel_id, tags in guild_data["channel_tags"].items() if tag in tags]
+    limiter = CrawlLimiter(LOG_CONCURRENCY)
+    targets = await tagged_targets(ctx.guild, tagged_channels, limiter)
+    if not targets:
+        await ctx.send(f'No channels found with tag: {tag}')
+        return
+
+    status = await ctx.send(f'Archiving {len(targets)} channels and threads with tag {tag}...')
+    progress = CrawlProgress(status, len(targets))
+
+    async def backfill(channel, parent, thread_name):
+        try:
+            await sync_archive(channel, limiter, progress, parent.id if thread_name else None)
+        except (discord.RateLimited, discord.HTTPException):
+            progress.failed.append(f'{parent.name} > {thread_name}' if thread_name else parent.name)
+        progress.done += 1
+        await progress.update()
+
+    await asyncio.gather(*(backfill(*target) for target in targets))
+    await progress.update(force=True)
+    await ctx.send(f'Archived {progress.fetched} messages with tag {tag}')
+    if progress.failed:
+        await ctx.send(f'Could not read: {", ".join(progress.failed)}')
+
+@bot.command(name='search', help='Searches archived messages in channels with a tag. Quote multi-word queries, optionally filter by alias or name')
+async def search_messages(ctx, tag: str, query: str, author: str = None):
+    if archive is None:
+        await ctx.send('Search needs the message archive. Set ARCHIVE_FILE to enable it.')
+        return
+    guild_data = get_guild_data(ctx.guild.id)
+    root_ids = [int(channel_id) for channel_id, tags in guild_data["channel_tags"].items() if tag in tags]
+    if not root_ids:
+        await ctx.send(f'No channels found with tag: {tag}')
+        return
+
+    author_ids = []
+    if author:
+        author_ids = [int(user_id) for user_id, alias in guild_data["registered_aliases"].items() if alias.lower() == author.lower()]
+    hits = archive.search(ctx.guild.id, root_ids, query, author_ids, author)
+    if not hits:
+        await ctx.send(f'No messages with tag {tag} match "{query}"')
+        return
+
+    aliases = guild_data["registered_aliases"]
+    embed = discord.Embed(title=f'Search: {query}', color=discord.Color.blue())
+    for message_id, channel_id, author_id, author_name, content in hits:
+        preview = content if len(content) <= 200 else content[:197] + '...'
+        embed.add_field(
+            name=aliases.get(str(author_id), author_name),
+            value=f'{preview}\n[Jump](https://discord.com/channels/{ctx.guild.id}/{channel_id}/{message_id})',
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@bot.command(name='set_whitelist', help='Sets the message format whitelist, separated by commas (write \\, for a comma inside a format). '
+                                        'Formats match anywhere in a message; prefix one with ^ to match only at the start, '
+                                        'with re: to use a regex, or with \\ to match a leading ^ or re: literally')
 @commands.has_permissions(administrator=True)
 async def set_whitelist(ctx, *, formats):
     guild_data = get_guild_data(ctx.guild.id)
-    # Split the formats by commas and strip whitespace
-    new_whitelist = [format.strip() for format in formats.split(',')]
+    # Split the formats on unescaped commas and strip whitespace
+    new_whitelist = split_formats(formats)
+    try:
+        matcher = compile_whitelist(new_whitelist)
+    except (ValueError, re.error) as e:
+        await ctx.send(str(e))
+        return
     guild_data["message_whitelist"] = new_whitelist
-    save_data()
+    whitelist_matchers[str(ctx.guild.id)] = matcher
+    save_data(ctx.guild.id)
     await ctx.send(f'Message format whitelist updated: {", ".join(new_whitelist)}')
 
+def get_whitelist_matcher(guild_id):
+    guild_id = str(guild_id)
+    if guild_id not in whitelist_matchers:
+        try:
+            whitelist_matchers[guild_id] = compile_whitelist(get_guild_data(guild_id)["message_whitelist"])
+        except (ValueError, re.error) as e:
+            # A stored whitelist that no longer compiles should not block logging
+            print(f"Ignoring invalid message whitelist for guild {guild_id}: {e}")
+            whitelist_matchers[guild_id] = None
+    return whitelist_matchers[guild_id]
+
 def is_valid_message_format(guild_id, content):
-    guild_data = get_guild_data(guild_id)
-    if not guild_data["message_whitelist"]:
-        return True
-    return any(format in content for format in guild_data["message_whitelist"])
+    matcher = get_whitelist_matcher(guild_id)
+    return matcher is None or matcher.search(content) is not None
 
 @bot.command(name='register_alias', help='Registers an alias for the user')
 async def register_alias(ctx, alias: str):
     guild_data = get_guild_data(ctx.guild.id)
     guild_data["registered_aliases"][str(ctx.author.id)] = alias
-    save_data()
+    save_data(ctx.guild.id)
     await ctx.send(f'Your alias has been registered as "{alias}".')
 
 def get_registered_alias(guild_id, author):
@@ -1,9 +1,12 @@
-import json
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from discord.ext import commands
 from .currency import CurrencySystem
 from .wallet import WalletSystem
 from .item import ItemSystem
-from .market import MarketSystem
+from .market import MarketSystem, upgrade_markets
 from .job import JobSystem
 from .bank import BankSystem
 from .resource import ResourceSystem
@@ -13,6 +16,25 @@ from .loan import LoanSystem
 from .analytics import AnalyticsSystem
 from .permissions import PermissionSystem
 from .config import ConfigSystem
+from .storage import create_storage, new_guild_data
+from .snapshot import LazyGuildData
+from .balances import Balances
+from .leaderboard import Leaderboards
+from .aggregates import Aggregates
+from .journal import Journal, apply_record
+
+# Seconds between the first unsaved change and the write-behind flush
+FLUSH_INTERVAL = float(os.getenv('ECONOMY_FLUSH_INTERVAL', '5'))
+# Journaled changes are already durable, so their snapshot (compaction) can wait longer
+COMPACT_INTERVAL = float(os.getenv('ECONOMY_COMPACT_INTERVAL', '300'))
+# Journal size that triggers an immediate snapshot + compaction
+COMPACT_BYTES = int(os.getenv('ECONOMY_COMPACT_BYTES', str(1024 * 1024)))
+# Most guilds kept in memory at once (0 for no limit); least recently used are evicted first
+MAX_RESIDENT_GUILDS = int(os.getenv('ECONOMY_MAX_GUILDS', '0'))
+# Seconds without access after which a guild is flushed and evicted
+IDLE_SECONDS = float(os.getenv('ECONOMY_IDLE_SECONDS', '3600'))
+# Seconds between eviction passes
+EVICT_INTERVAL = float(os.getenv('ECONOMY_EVICT_INTERVAL', '60'))
 
 class EconomySystem:
     def __init__(self, bot):
@@ -30,52 +52,199 @@ class EconomySystem:
         self.analytics = AnalyticsSystem(self)
         self.permissions = PermissionSystem(self)
         self.config = ConfigSystem(self)
+        self.balances = Balances(self)
+        self.leaderboards = Leaderboards(self)
+        self.aggregates = Aggregates(self)
         self.data = {}
+        self.storage = create_storage()
+        self.journal = Journal()
+        self.dirty = {}
+        self.flushing = {}
+        self.flush_task = None
+        self.flush_deadline = None
+        self.last_used = OrderedDict()
+        self.loading = {}
+        self.evict_task = None
+        # Load the invoking guild before an economy command touches get_guild_data.
+        # Commands live on the subsystem classes, so a reloaded extension replaces the old instance's check
+        for command in self.commands():
+            for check in [check for check in command.checks if getattr(check, "__func__", None) is EconomySystem.ensure_loaded]:
+                command.remove_check(check)
+            command.add_check(self.ensure_loaded)
+
+    def commands(self):
+        """Top-level commands defined on the subsystems; group checks also cover their subcommands."""
+        systems = (self.currency, self.wallet, self.item, self.market, self.job, self.bank, self.resource,
+                   self.crafting, self.tax, self.loan, self.analytics, self.permissions, self.config)
+        return [value for system in systems for value in vars(type(system)).values() if isinstance(value, commands.Command)]
+
+    def mark_dirty(self, guild_id, *sections, delay=FLUSH_INTERVAL):
+        """Record that sections of a guild changed and schedule a write-behind flush."""
+        self.dirty.setdefault(str(guild_id), set()).update(sections)
+        self.schedule_flush(delay)
+
+    def schedule_flush(self, delay):
+        deadline = asyncio.get_running_loop().time() + delay
+        if self.flush_task and not self.flush_task.done():
+            if self.flush_deadline <= deadline:
+                return
+            self.flush_task.cancel()
+        self.flush_deadline = deadline
+        self.flush_task = asyncio.create_task(self.flush_later(delay))
+
+    async def flush_later(self, delay):
+        # Changes made while waiting are coalesced into the same flush
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        await self.save_data()
+
+    def apply(self, guild_id, op, path, value=None):
+        """Mutate guild data through the journal (see journal.apply_record for ops)."""
+        guild_id = str(guild_id)
+        # A scale pass reports its effect on the totals itself, through aggregates.adjust
+        measured = self.aggregates.before(guild_id, path) if op != "scale" else None
+        apply_record(self.get_guild_data(guild_id), op, path, value)
+        self.aggregates.after(guild_id, measured)
+        self.leaderboards.changed(guild_id, path)
+        self.journal.record(guild_id, op, path, value)
+        if self.journal.sizes.get(guild_id, 0) > COMPACT_BYTES:
+            self.mark_dirty(guild_id, path[0], delay=0)
+        else:
+            self.mark_dirty(guild_id, path[0], delay=COMPACT_INTERVAL)
+
+    def credit(self, guild_id, path, amount):
+        self.apply(guild_id, "add", path, amount)
 
     async def save_data(self):
-        for guild in self.bot.guilds:
-            guild_id = str(guild.id)
-            if guild_id not in self.data:
-                continue
-            filename = f'data/economy_{guild_id}.json'
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            with open(filename, 'w') as f:
-                json.dump(self.data[guild_id], f)
+        self.flushing, self.dirty = self.dirty, {}
+        for guild_id, sections in self.flushing.items():
+            await self.save_guild(guild_id, sections)
+        self.flushing = {}
+        if self.dirty:
+            self.schedule_flush(FLUSH_INTERVAL)
+
+    async def save_guild(self, guild_id, sections):
+        if guild_id not in self.data:
+            return False
+        # The snapshot covers every record up to snapshot_seq, so it must also rewrite the
+        # sections changed since save_data took this guild's dirty set
+        sections |= self.dirty.pop(guild_id, set())
+        snapshot_seq = self.journal.seq.get(guild_id, 0)
+        self.data[guild_id]["journal_seq"] = snapshot_seq
+        sections.add("journal_seq")
+        payload = self.storage.dump_guild(guild_id, self.balances.storable(self.data[guild_id]), sections)
+        try:
+            await asyncio.to_thread(self.storage.write_guild, guild_id, payload)
+            kept = await asyncio.to_thread(self.journal.compact, guild_id, snapshot_seq)
+            self.journal.sizes[guild_id] = kept + sum(len(line) for line in self.journal.pending.get(guild_id, []))
+            return True
+        except Exception as e:
+            print(f"Failed to save economy data for guild {guild_id}: {e}")
+            # Write the whole guild again on the next flush
+            if guild_id in self.data:
+                self.dirty.setdefault(guild_id, set()).update(self.data[guild_id])
+            return False
+
+    async def close(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        if self.evict_task and not self.evict_task.done():
+            self.evict_task.cancel()
+        if self.job.payroll_task and not self.job.payroll_task.done():
+            self.job.payroll_task.cancel()
+        if self.aggregates.verify_task and not self.aggregates.verify_task.done():
+            self.aggregates.verify_task.cancel()
+        await self.job.save_payroll()
+        await self.journal.commit()
+        await self.save_data()
+        self.storage.close()
 
     async def load_data(self):
-        for guild in self.bot.guilds:
-            guild_id = str(guild.id)
-            filename = f'data/economy_{guild_id}.json'
-            if os.path.exists(filename):
-                with open(filename, 'r') as f:
-                    self.data[guild_id] = json.load(f)
-            else:
-                self.data[guild_id] = {
-                    "currencies": {},
-                    "wallets": {},
-                    "items": {},
-                    "markets": {},
-                    "jobs": {},
-                    "banks": {},
-                    "resources": {},
-                    "recipes": {},
-                    "loans": {},
-                    "config": {}
-                }
+        # Guilds are loaded on first use, so startup does not depend on how many exist on disk
+        if self.evict_task is None or self.evict_task.done():
+            self.evict_task = asyncio.create_task(self.evict_loop())
+        self.job.start_payroll()
+        self.aggregates.start()
+
+    def read_guild(self, guild_id):
+        data = self.storage.load_guild(guild_id)
+        if data is None:
+            data = new_guild_data()
+        elif not (isinstance(data, LazyGuildData) and data.has_orders()):
+            # Journal records address listings by order ID, so old list-shaped markets are converted first.
+            # Snapshots holding orders are current, and their markets stay undecoded until first used
+            data = upgrade_markets(data)
+        data = self.journal.replay(guild_id, data)
+        return self.balances.adopt(data)
+
+    async def ensure_loaded(self, ctx):
+        if ctx.guild is not None:
+            await self.load_guild(ctx.guild.id)
+        return True
+
+    async def load_guild(self, guild_id):
+        """Load a guild off the event loop; concurrent callers share a single read."""
+        guild_id = str(guild_id)
+        if guild_id in self.data:
+            self.touch(guild_id)
+            return self.data[guild_id]
+        if self.evict_task is None or self.evict_task.done():
+            self.evict_task = asyncio.create_task(self.evict_loop())
+        self.job.start_payroll()
+        self.aggregates.start()
+        future = self.loading.get(guild_id)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self.read_guild, guild_id))
+            self.loading[guild_id] = future
+            future.add_done_callback(lambda _: self.loading.pop(guild_id, None))
+        data = await asyncio.shield(future)
+        # get_guild_data may have loaded it synchronously while the read was running
+        if guild_id not in self.data:
+            self.data[guild_id] = data
+            self.job.schedule_guild(guild_id, data)
+        self.touch(guild_id)
+        return self.data[guild_id]
 
     def get_guild_data(self, guild_id):
         guild_id = str(guild_id)
         if guild_id not in self.data:
-            self.data[guild_id] = {
-                "currencies": {},
-                "wallets": {},
-                "items": {},
-                "markets": {},
-                "jobs": {},
-                "banks": {},
-                "resources": {},
-                "recipes": {},
-                "loans": {},
-                "config": {}
-            }
-        return self.data[guild_id]
\ No newline at end of file
+            # Fallback for callers outside commands, e.g. the periodic processors
+            self.data[guild_id] = self.read_guild(guild_id)
+            self.job.schedule_guild(guild_id, self.data[guild_id])
+        self.touch(guild_id)
+        return self.data[guild_id]
+
+    def touch(self, guild_id):
+        self.last_used[guild_id] = time.monotonic()
+        self.last_used.move_to_end(guild_id)
+
+    async def evict_loop(self):
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            await self.evict_idle()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        candidates = [guild_id for guild_id, used in self.last_used.items() if now - used > IDLE_SECONDS]
+        if MAX_RESIDENT_GUILDS and len(self.last_used) > MAX_RESIDENT_GUILDS:
+            # last_used is kept in LRU order, oldest first
+            for guild_id in list(self.last_used)[:len(self.last_used) - MAX_RESIDENT_GUILDS]:
+                if guild_id not in candidates:
+                    candidates.append(guild_id)
+        for guild_id in candidates:
+            await self.evict_guild(guild_id)
+
+    async def evict_guild(self, guild_id):
+        used = self.last_used.get(guild_id)
+        if guild_id in self.dirty:
+            if not await self.save_guild(guild_id, self.dirty.pop(guild_id)):
+                return
+        if self.last_used.get(guild_id) != used or guild_id in self.dirty or guild_id in self.flushing:
+            # Used or changed again while it was being flushed
+            return
+        self.data.pop(guild_id, None)
+        self.leaderboards.invalidate(guild_id)
+        self.aggregates.invalidate(guild_id)
+        self.market.forget(guild_id)
+        self.last_used.pop(guild_id, None)
+        self.storage.forget(guild_id)
@@ -0,0 +1,152 @@
+import asyncio
+import os
+
+# Seconds between passes that recount every resident guild's aggregates to catch drift
+VERIFY_INTERVAL = float(os.getenv('ECONOMY_VERIFY_INTERVAL', '3600'))
+# Differences below this are float rounding, not drift
+DRIFT_TOLERANCE = 1e-6
+
+
+def new_totals():
+    # supply counts wallets, bank deposits and money escrowed in open bids
+    return {"supply": {}, "market_value": {}, "listings": 0, "active_loans": 0}
+
+
+def entity(path):
+    """The wallet, account, order or loan a change at path can affect.
+
+    () when the change cannot move any aggregate, None when it replaces more
+    than one entity at once.
+    """
+    section = path[0]
+    if section in ("wallets", "loans"):
+        return tuple(path[:2]) if len(path) >= 2 else None
+    if section in ("banks", "markets"):
+        if len(path) >= 3 and path[2] not in ("accounts", "listings"):
+            return ()
+        return tuple(path[:4]) if len(path) >= 4 else None
+    return ()
+
+
+def contribution(guild_data, root):
+    """What one entity adds to the totals, as {(total, currency or None): amount}."""
+    values = {}
+    if root[0] == "wallets":
+        for currency, amount in (guild_data["wallets"].get(root[1]) or {}).items():
+            values[("supply", currency)] = amount
+    elif root[0] == "banks":
+        account = guild_data["banks"].get(root[1], {}).get("accounts", {}).get(root[3]) or {}
+        for currency, amount in account.items():
+            values[("supply", currency)] = amount
+    elif root[0] == "markets":
+        order = guild_data["markets"].get(root[1], {}).get("listings", {}).get(root[3])
+        if order is not None:
+            values[("listings", None)] = 1
+            total = "market_value" if order["side"] == "ask" else "supply"
+            values[(total, order["currency"])] = order["amount"] * order["price"]
+    elif root[0] == "loans":
+        loan = guild_data.get("loans", {}).get(root[1])
+        if loan is not None and loan.get("status") == "approved":
+            values[("active_loans", None)] = 1
+    return values
+
+
+class Aggregates:
+    """Guild-wide totals for economy_report, moved by every change instead of recounted.
+
+    EconomySystem.apply measures the entity a change touches before and after
+    it and adds the difference. Scale passes (taxes, interest) report their
+    effect through adjust. Totals are counted in full the first time a
+    guild is asked for, and a periodic pass recounts them to detect drift.
+    """
+
+    def __init__(self, economy):
+        self.economy = economy
+        self.totals = {}
+        self.verify_task = None
+
+    def count(self, guild_data):
+        totals = new_totals()
+        roots = [("wallets", user_id) for user_id in guild_data["wallets"]]
+        roots += [("loans", user_id) for user_id in guild_data.get("loans", {})]
+        for bank, bank_data in guild_data["banks"].items():
+            roots += [("banks", bank, "accounts", user_id) for user_id in bank_data["accounts"]]
+        for market, market_data in guild_data["markets"].items():
+            roots += [("markets", market, "listings", key) for key in market_data["listings"]]
+        for root in roots:
+            self.add(totals, contribution(guild_data, root), 1)
+        return totals
+
+    def add(self, totals, values, sign):
+        for (total, currency), amount in values.items():
+            if currency is None:
+                totals[total] += sign * amount
+            else:
+                totals[total][currency] = totals[total].get(currency, 0) + sign * amount
+
+    def get(self, guild_id):
+        guild_id = str(guild_id)
+        if guild_id not in self.totals:
+            self.totals[guild_id] = self.count(self.economy.get_guild_data(guild_id))
+        return self.totals[guild_id]
+
+    def before(self, guild_id, path):
+        """Call before applying a change at path; pass the result to after."""
+        if guild_id not in self.totals:
+            return None
+        root = entity(path)
+        if root is None:
+            self.invalidate(guild_id)
+            return None
+        if not root:
+            return None
+        return root, contribution(self.economy.get_guild_data(guild_id), root)
+
+    def after(self, guild_id, measured):
+        if measured is None or guild_id not in self.totals:
+            return
+        root, old = measured
+        totals = self.totals[guild_id]
+        self.add(totals, old, -1)
+        self.add(totals, contribution(self.economy.get_guild_data(guild_id), root), 1)
+
+    def adjust(self, guild_id, total, currency, amount):
+        totals = self.totals.get(str(guild_id))
+        if totals is not None:
+            self.add(totals, {(total, currency): amount}, 1)
+
+    def invalidate(self, guild_id):
+        self.totals.pop(str(guild_id), None)
+
+    def verify(self, guild_id):
+        """Recount a guild and replace its totals; returns the names of the totals that had drifted."""
+        guild_id = str(guild_id)
+        if guild_id not in self.totals:
+            return []
+        expected = self.count(self.economy.get_guild_data(guild_id))
+        current = self.totals[guild_id]
+        drifted = []
+        for total, value in expected.items():
+            if isinstance(value, dict):
+                for currency in set(value) | set(current[total]):
+                    if abs(value.get(currency, 0) - current[total].get(currency, 0)) > DRIFT_TOLERANCE:
+                        drifted.append(f"{total} {currency}")
+            elif abs(value - current[total]) > DRIFT_TOLERANCE:
+                drifted.append(total)
+        self.totals[guild_id] = expected
+        return drifted
+
+    def start(self):
+        if self.verify_task is None or self.verify_task.done():
+            self.verify_task = asyncio.create_task(self.verify_loop())
+
+    async def verify_loop(self):
+        while True:
+            await asyncio.sleep(VERIFY_INTERVAL)
+            for guild_id in list(self.totals):
+                if guild_id not in self.economy.data:
+                    self.invalidate(guild_id)
+                    continue
+                drifted = self.verify(guild_id)
+                if drifted:
+                    print(f"Economy aggregates for guild {guild_id} had drifted and were recounted: {', '.join(drifted)}")
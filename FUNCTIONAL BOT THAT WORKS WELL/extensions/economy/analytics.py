@@ -1,5 +1,10 @@
+import time
 import discord
 from discord.ext import commands
+from .trades import CANDLE_PERIODS, trade_summary
+
+# Most fields in one embed
+EMBED_FIELDS = 25
 
 class AnalyticsSystem:
     def __init__(self, economy):
@@ -11,67 +16,84 @@ class AnalyticsSystem:
     @commands.has_permissions(administrator=True)
     async def economy_report(self, ctx):
         guild_data = self.economy.get_guild_data(ctx.guild.id)
+        totals = self.economy.aggregates.get(ctx.guild.id)
         embed = discord.Embed(title="Economy Report", color=discord.Color.gold())
         
-        # Currency circulation
-        for currency, data in guild_data["currencies"].items():
-            embed.add_field(name=f"{currency} Circulation", value=data["in_circulation"])
+        # Money supply: wallets, bank deposits and money held by open bids
+        for currency in guild_data["currencies"]:
+            embed.add_field(name=f"{currency} Circulation", value=totals["supply"].get(currency, 0))
         
-        # Total market value
-        total_market_value = sum(listing["amount"] * listing["price"] 
-                                 for market in guild_data["markets"].values() 
-                                 for listing in market["listings"])
-        embed.add_field(name="Total Market Value", value=total_market_value)
+        # Value of the items listed for sale, per currency
+        for currency, value in totals["market_value"].items():
+            embed.add_field(name=f"Total Market Value ({currency})", value=value)
+        embed.add_field(name="Open Listings", value=totals["listings"])
         
         # Number of jobs
         embed.add_field(name="Number of Jobs", value=len(guild_data["jobs"]))
         
-        # Number of active loans
-        active_loans = sum(1 for loan in guild_data.get("loans", {}).values() if loan["status"] == "approved")
-        embed.add_field(name="Active Loans", value=active_loans)
+        embed.add_field(name="Active Loans", value=totals["active_loans"])
         
         await ctx.send(embed=embed)
 
     @commands.command(name="leaderboard")
-    async def leaderboard(self, ctx, currency: str):
+    async def leaderboard(self, ctx, currency: str, networth: bool = False):
         guild_data = self.economy.get_guild_data(ctx.guild.id)
         if currency not in guild_data["currencies"]:
             await ctx.send(f"Currency {currency} does not exist.")
             return
         
-        wallets = guild_data["wallets"]
-        sorted_wallets = sorted(wallets.items(), key=lambda x: x[1].get(currency, 0), reverse=True)
+        top_wallets = self.economy.leaderboards.top(ctx.guild.id, currency, 10, networth)
         
-        embed = discord.Embed(title=f"Wealth Leaderboard - {currency}", color=discord.Color.gold())
-        for i, (user_id, wallet) in enumerate(sorted_wallets[:10], 1):
+        title = "Net Worth Leaderboard" if networth else "Wealth Leaderboard"
+        embed = discord.Embed(title=f"{title} - {currency}", color=discord.Color.gold())
+        for i, (user_id, amount) in enumerate(top_wallets, 1):
             user = ctx.guild.get_member(int(user_id))
             if user:
-                embed.add_field(name=f"{i}. {user.name}", value=f"{wallet.get(currency, 0)} {currency}", inline=False)
+                embed.add_field(name=f"{i}. {user.name}", value=f"{amount} {currency}", inline=False)
         
         await ctx.send(embed=embed)
 
+    @commands.command(name="rank")
+    async def rank(self, ctx, currency: str, member: discord.Member = None, networth: bool = False):
+        guild_data = self.economy.get_guild_data(ctx.guild.id)
+        if currency not in guild_data["currencies"]:
+            await ctx.send(f"Currency {currency} does not exist.")
+            return
+        
+        member = member or ctx.author
+        position = self.economy.leaderboards.rank(ctx.guild.id, member.id, currency, networth)
+        if position is None:
+            await ctx.send(f"{member.name} has no {currency} yet.")
+            return
+        place, amount, ranked = position
+        label = "net worth" if networth else "balance"
+        await ctx.send(f"{member.name} is #{place} of {ranked} by {currency} {label} with {amount} {currency}.")
+
     @commands.command(name="market_trends")
     async def market_trends(self, ctx):
         guild_data = self.economy.get_guild_data(ctx.guild.id)
         embed = discord.Embed(title="Market Trends", color=discord.Color.blue())
+        now = time.time()
         
-        for market_name, market_data in guild_data["markets"].items():
-            if not market_data["listings"]:
-                continue
-            
-            avg_prices = {}
-            for listing in market_data["listings"]:
-                item = listing["item"]
-                price = listing["price"]
-                currency = listing["currency"]
-                if item not in avg_prices:
-                    avg_prices[item] = {"total": 0, "count": 0, "currency": currency}
-                avg_prices[item]["total"] += price
-                avg_prices[item]["count"] += 1
-            
-            for item, data in avg_prices.items():
-                avg_price = data["total"] / data["count"]
-                embed.add_field(name=f"{item} in {market_name}", 
-                                value=f"Avg Price: {avg_price:.2f} {data['currency']}")
+        for market_name, items in guild_data.get("trade_history", {}).items():
+            listings = guild_data["markets"].get(market_name, {}).get("listings", {})
+            for item, currencies in items.items():
+                for currency, stats in currencies.items():
+                    if len(embed.fields) >= EMBED_FIELDS:
+                        break
+                    summary = trade_summary(stats, now)
+                    lines = [f"Last: {summary['last']} {currency}, VWAP: {summary['vwap']:.2f} {currency}, Volume: {summary['volume']}"]
+                    for name, _, _ in CANDLE_PERIODS:
+                        candle = summary[name]
+                        if candle:
+                            lines.append(f"{name}: O {candle[1]} H {candle[2]} L {candle[3]} C {candle[4]}, Volume: {candle[5]}")
+                    if market_name in guild_data["markets"]:
+                        ask = self.economy.market.book(ctx.guild.id, market_name).best(listings, "ask", item, currency)
+                        if ask:
+                            lines.append(f"Best ask: {ask['price']} {currency}")
+                    embed.add_field(name=f"{item} in {market_name}", value="\n".join(lines), inline=False)
         
+        if not embed.fields:
+            await ctx.send("No trades yet.")
+            return
         await ctx.send(embed=embed)
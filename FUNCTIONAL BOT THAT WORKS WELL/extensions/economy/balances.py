@@ -0,0 +1,213 @@
+import os
+from collections.abc import MutableMapping
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 'dict' keeps wallets as nested dicts, 'columnar' as one NumPy matrix per guild (needs numpy)
+BALANCE_STORE = os.getenv('ECONOMY_BALANCE_STORE', 'dict')
+
+
+class WalletView(MutableMapping):
+    """One user's row of a ColumnarWallets, usable like the wallet dict it replaces."""
+
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+
+    def __getitem__(self, currency):
+        column = self.store.columns.get(currency)
+        row = self.store.rows[self.user_id]
+        if column is None or not self.store.touched[row, column]:
+            raise KeyError(currency)
+        return float(self.store.values[row, column])
+
+    def __setitem__(self, currency, amount):
+        column = self.store.column(currency)
+        row = self.store.rows[self.user_id]
+        self.store.values[row, column] = amount
+        self.store.touched[row, column] = True
+
+    def __delitem__(self, currency):
+        column = self.store.columns.get(currency)
+        row = self.store.rows[self.user_id]
+        if column is None or not self.store.touched[row, column]:
+            raise KeyError(currency)
+        self.store.values[row, column] = 0
+        self.store.touched[row, column] = False
+
+    def __iter__(self):
+        row = self.store.touched[self.store.rows[self.user_id]]
+        return iter([currency for currency, column in self.store.columns.items() if row[column]])
+
+    def __len__(self):
+        return int(self.store.touched[self.store.rows[self.user_id]].sum())
+
+
+class ColumnarWallets(MutableMapping):
+    """guild_data["wallets"] kept as a 2-D float array.
+
+    Users are interned to rows and currencies to columns. Both dimensions grow by
+    doubling, so a new currency is one more column rather than a key in every
+    wallet. It keeps the mapping interface of the nested dicts, so journal replay
+    and apply_record work on it unchanged. A boolean mask marks the cells a wallet
+    actually holds, so wallets list and store only the currencies they have used.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        # row -> user ID, None for rows freed by a deleted wallet
+        self.user_ids = []
+        self.free_rows = []
+        self.columns = {}
+        self.currencies = []
+        self.values = numpy.zeros((16, 4))
+        self.touched = numpy.zeros((16, 4), dtype=bool)
+
+    @classmethod
+    def from_dict(cls, wallets):
+        store = cls()
+        for user_id, wallet in wallets.items():
+            store[user_id] = wallet
+        return store
+
+    def row(self, user_id):
+        row = self.rows.get(user_id)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+                self.user_ids[row] = user_id
+            else:
+                row = len(self.user_ids)
+                self.user_ids.append(user_id)
+                if row >= self.values.shape[0]:
+                    self.grow(row * 2, self.values.shape[1])
+            self.rows[user_id] = row
+        return row
+
+    def column(self, currency):
+        column = self.columns.get(currency)
+        if column is None:
+            column = self.columns[currency] = len(self.currencies)
+            self.currencies.append(currency)
+            if column >= self.values.shape[1]:
+                self.grow(self.values.shape[0], column * 2)
+        return column
+
+    def grow(self, rows, columns):
+        values = numpy.zeros((rows, columns))
+        values[:self.values.shape[0], :self.values.shape[1]] = self.values
+        self.values = values
+        touched = numpy.zeros((rows, columns), dtype=bool)
+        touched[:self.touched.shape[0], :self.touched.shape[1]] = self.touched
+        self.touched = touched
+
+    def used(self):
+        # Live block of the matrix; freed rows are all zeros
+        return self.values[:len(self.user_ids), :len(self.currencies)]
+
+    def __getitem__(self, user_id):
+        if user_id not in self.rows:
+            raise KeyError(user_id)
+        return WalletView(self, user_id)
+
+    def __setitem__(self, user_id, wallet):
+        row = self.row(user_id)
+        self.values[row] = 0
+        self.touched[row] = False
+        for currency, amount in wallet.items():
+            # column() may reallocate values, so it has to run first
+            column = self.column(currency)
+            self.values[row, column] = amount
+            self.touched[row, column] = True
+
+    def __delitem__(self, user_id):
+        row = self.rows.pop(user_id)
+        self.values[row] = 0
+        self.touched[row] = False
+        self.user_ids[row] = None
+        self.free_rows.append(row)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def setdefault(self, user_id, default=None):
+        # apply_record walks paths with setdefault and must get the live row back
+        if user_id not in self.rows:
+            self[user_id] = default or {}
+        return self[user_id]
+
+    def to_dict(self):
+        # Sparse like the nested dicts, so saved wallets do not grow with every new currency
+        balances = self.used().tolist()
+        touched = self.touched[:len(self.user_ids), :len(self.currencies)].tolist()
+        return {
+            user_id: {currency: amount for currency, amount, held in zip(self.currencies, balances[row], touched[row]) if held}
+            for user_id, row in self.rows.items()
+        }
+
+    def totals(self):
+        return dict(zip(self.currencies, self.used().sum(axis=0).tolist()))
+
+    def scale(self, factor):
+        self.used()[:] *= factor
+
+
+class Balances:
+    """Wallet reads and writes shared by the economy systems, for either balance store.
+
+    Writes go through EconomySystem.credit, so they are journaled like any other
+    change. Whole-guild passes such as taxes are one array expression with the
+    columnar store.
+    """
+
+    def __init__(self, economy, store=BALANCE_STORE):
+        if store not in ('dict', 'columnar'):
+            raise ValueError(f"Unknown economy balance store: {store}")
+        if store == 'columnar' and numpy is None:
+            raise RuntimeError("The columnar balance store needs numpy installed")
+        self.economy = economy
+        self.columnar = store == 'columnar'
+
+    def adopt(self, data):
+        """Convert a freshly read guild's wallets to the configured store."""
+        if self.columnar and not isinstance(data.get("wallets"), ColumnarWallets):
+            data["wallets"] = ColumnarWallets.from_dict(data.get("wallets", {}))
+        return data
+
+    def storable(self, data):
+        """The guild dict with plain dict wallets, for the storage backends."""
+        if isinstance(data.get("wallets"), ColumnarWallets):
+            return {**data, "wallets": data["wallets"].to_dict()}
+        return data
+
+    def get(self, guild_id, user_id, currency):
+        wallet = self.economy.get_guild_data(guild_id)["wallets"].get(str(user_id))
+        return wallet.get(currency, 0) if wallet is not None else 0
+
+    def wallet(self, guild_id, user_id):
+        guild_data = self.economy.get_guild_data(guild_id)
+        wallet = guild_data["wallets"].get(str(user_id)) or {}
+        return {currency: wallet.get(currency, 0) for currency in guild_data["currencies"]}
+
+    def add(self, guild_id, user_id, currency, amount):
+        # A missing wallet is created by the journaled add itself
+        self.economy.credit(guild_id, ["wallets", str(user_id), currency], amount)
+
+    def collect_tax(self, guild_id, rate):
+        """Take rate of every balance as one journaled scale; returns the amount collected per currency."""
+        wallets = self.economy.get_guild_data(guild_id)["wallets"]
+        if isinstance(wallets, ColumnarWallets):
+            totals = wallets.totals()
+        else:
+            totals = {}
+            for wallet in wallets.values():
+                for currency, amount in wallet.items():
+                    totals[currency] = totals.get(currency, 0) + amount
+        self.economy.apply(guild_id, "scale", ["wallets"], 1 - rate)
+        return {currency: total * rate for currency, total in totals.items()}
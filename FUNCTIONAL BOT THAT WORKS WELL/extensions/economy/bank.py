@@ -18,10 +18,11 @@ class BankSystem:
         if name in guild_data["banks"]:
             await ctx.send(f"Bank {name} already exists.")
             return
-        guild_data["banks"][name] = {
+        # Journaled, so deposits replayed after a crash land in a bank that has its interest rate
+        self.economy.apply(ctx.guild.id, "set", ["banks", name], {
             "interest_rate": interest_rate,
             "accounts": {}
-        }
+        })
         await ctx.send(f"Bank {name} created with interest rate {interest_rate}.")
 
     @bank.command(name="deposit")
@@ -34,17 +35,11 @@ class BankSystem:
             await ctx.send(f"Currency {currency} does not exist.")
             return
         user_id = str(ctx.author.id)
-        if user_id not in guild_data["wallets"]:
-            guild_data["wallets"][user_id] = {cur: 0 for cur in guild_data["currencies"]}
-        if guild_data["wallets"][user_id][currency] < amount:
+        if self.economy.balances.get(ctx.guild.id, user_id, currency) < amount:
             await ctx.send("Insufficient funds.")
             return
-        if user_id not in guild_data["banks"][name]["accounts"]:
-            guild_data["banks"][name]["accounts"][user_id] = {}
-        if currency not in guild_data["banks"][name]["accounts"][user_id]:
-            guild_data["banks"][name]["accounts"][user_id][currency] = 0
-        guild_data["wallets"][user_id][currency] -= amount
-        guild_data["banks"][name]["accounts"][user_id][currency] += amount
+        self.economy.balances.add(ctx.guild.id, user_id, currency, -amount)
+        self.economy.credit(ctx.guild.id, ["banks", name, "accounts", user_id, currency], amount)
         await ctx.send(f"Deposited {amount} {currency} into {name}.")
 
     @bank.command(name="withdraw")
@@ -66,8 +61,8 @@ class BankSystem:
         if guild_data["banks"][name]["accounts"][user_id][currency] < amount:
             await ctx.send("Insufficient funds in the bank account.")
             return
-        guild_data["banks"][name]["accounts"][user_id][currency] -= amount
-        guild_data["wallets"][user_id][currency] += amount
+        self.economy.credit(ctx.guild.id, ["banks", name, "accounts", user_id, currency], -amount)
+        self.economy.balances.add(ctx.guild.id, user_id, currency, amount)
         await ctx.send(f"Withdrawn {amount} {currency} from {name}.")
 
     @bank.command(name="balance")
@@ -89,7 +84,12 @@ class BankSystem:
         for guild in self.bot.guilds:
             guild_data = self.economy.get_guild_data(guild.id)
             for bank_name, bank_data in guild_data["banks"].items():
-                for account_id, account in bank_data["accounts"].items():
+                rate = bank_data["interest_rate"] / 24  # Hourly interest
+                deposits = {}
+                for account in bank_data["accounts"].values():
                     for currency, amount in account.items():
-                        interest = amount * bank_data["interest_rate"] / 24  # Hourly interest
-                        account[currency] += interest
+                        deposits[currency] = deposits.get(currency, 0) + amount
+                # One journal record per bank instead of one per account
+                self.economy.apply(guild.id, "scale", ["banks", bank_name, "accounts"], 1 + rate)
+                for currency, amount in deposits.items():
+                    self.economy.aggregates.adjust(guild.id, "supply", currency, amount * rate)
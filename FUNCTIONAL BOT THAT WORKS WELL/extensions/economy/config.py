@@ -20,6 +20,7 @@ class ConfigSystem:
         try:
             # Convert value to float for economic parameters
             guild_data["config"][parameter] = float(value)
+            self.economy.mark_dirty(ctx.guild.id, "config")
             await ctx.send(f"Updated {parameter} to {value}")
         except ValueError:
             await ctx.send("Invalid value. Please provide a number.")
@@ -31,6 +32,7 @@ class ConfigSystem:
         if "eco_hooks" not in guild_data:
             guild_data["eco_hooks"] = {}
         guild_data["eco_hooks"][trigger] = action
+        self.economy.mark_dirty(ctx.guild.id, "eco_hooks")
         await ctx.send(f"Created economy hook: {trigger} -> {action}")
 
     @commands.command(name="show_config")
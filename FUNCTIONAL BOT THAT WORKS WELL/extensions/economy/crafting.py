@@ -24,6 +24,7 @@ class CraftingSystem:
             amount = float(ingredients[i+1])
             recipe[item] = amount
         guild_data["recipes"][name] = recipe
+        self.economy.mark_dirty(ctx.guild.id, "recipes")
         await ctx.send(f"Recipe {name} created with ingredients: {', '.join(f'{k}: {v}' for k, v in recipe.items())}.")
 
     @recipe.command(name="info")
@@ -64,4 +65,5 @@ class CraftingSystem:
         for item, amount in guild_data["recipes"][recipe].items():
             guild_data["inventories"][user_id][item] -= amount
         guild_data["inventories"][user_id][recipe] = guild_data["inventories"][user_id].get(recipe, 0) + 1
+        self.economy.mark_dirty(ctx.guild.id, "inventories")
         await ctx.send(f"Successfully crafted {recipe}.")
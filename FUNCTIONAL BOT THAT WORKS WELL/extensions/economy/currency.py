@@ -18,12 +18,13 @@ class CurrencySystem:
         if name in guild_data["currencies"]:
             await ctx.send(f"Currency {name} already exists.")
             return
-        guild_data["currencies"][name] = {
+        # Journaled, as tax collection journals in_circulation changes to this currency
+        self.economy.apply(ctx.guild.id, "set", ["currencies", name], {
             "symbol": symbol,
             "exchange_rate": exchange_rate,
             "total_supply": 0,
             "in_circulation": 0
-        }
+        })
         await ctx.send(f"Currency {name} ({symbol}) created with exchange rate {exchange_rate}.")
 
     @currency.command(name="adjust")
@@ -32,7 +33,7 @@ class CurrencySystem:
         if name not in guild_data["currencies"]:
             await ctx.send(f"Currency {name} does not exist.")
             return
-        guild_data["currencies"][name]["total_supply"] += amount
+        self.economy.credit(ctx.guild.id, ["currencies", name, "total_supply"], amount)
         await ctx.send(f"Adjusted {name} supply by {amount}. New total supply: {guild_data['currencies'][name]['total_supply']}")
 
     @currency.command(name="info")
@@ -46,5 +47,6 @@ class CurrencySystem:
         embed.add_field(name="Symbol", value=currency["symbol"])
         embed.add_field(name="Exchange Rate", value=currency["exchange_rate"])
         embed.add_field(name="Total Supply", value=currency["total_supply"])
-        embed.add_field(name="In Circulation", value=currency["in_circulation"])
+        supply = self.economy.aggregates.get(ctx.guild.id)["supply"].get(name, 0)
+        embed.add_field(name="In Circulation", value=supply)
         await ctx.send(embed=embed)
\ No newline at end of file
@@ -19,6 +19,7 @@ class ItemSystem:
             await ctx.send(f"Item {name} already exists.")
             return
         guild_data["items"][name] = {prop.split('=')[0]: prop.split('=')[1] for prop in properties}
+        self.economy.mark_dirty(ctx.guild.id, "items")
         await ctx.send(f"Item {name} created with properties: {', '.join(properties)}")
 
     @item.command(name="info")
@@ -41,6 +42,7 @@ class ItemSystem:
             guild_data["inventories"] = {}
         if user_id not in guild_data["inventories"]:
             guild_data["inventories"][user_id] = {}
+            self.economy.mark_dirty(ctx.guild.id, "inventories")
         
         embed = discord.Embed(title=f"Inventory for {ctx.author.name}", color=discord.Color.gold())
         for item, amount in guild_data["inventories"][user_id].items():
@@ -62,4 +64,5 @@ class ItemSystem:
             guild_data["inventories"][user_id] = {}
         
         guild_data["inventories"][user_id][item] = guild_data["inventories"][user_id].get(item, 0) + amount
+        self.economy.mark_dirty(ctx.guild.id, "inventories")
         await ctx.send(f"Gave {amount} {item} to {user.name}")
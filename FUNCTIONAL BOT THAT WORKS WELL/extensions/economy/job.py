@@ -1,10 +1,28 @@
+import asyncio
+import heapq
+import json
+import os
+import time
 import discord
 from discord.ext import commands
+from .storage import DATA_DIR, atomic_write
+
+# Next payday of every scheduled job, so payroll resumes after a restart without loading every guild
+PAYROLL_FILE = os.getenv('ECONOMY_PAYROLL_FILE', os.path.join(DATA_DIR, 'payroll.json'))
+# Seconds before retrying the payroll of a guild that failed to load
+PAYROLL_RETRY = float(os.getenv('ECONOMY_PAYROLL_RETRY', '60'))
 
 class JobSystem:
     def __init__(self, economy):
         self.economy = economy
         self.bot = economy.bot
+        # Min-heap of (next payday as a Unix timestamp, guild_id, job name)
+        self.payroll = []
+        # guild_id -> {job name: next payday}, the persisted copy of the heap
+        self.payroll_index = {}
+        self.payroll_changed = False
+        self.payroll_wakeup = asyncio.Event()
+        self.payroll_task = None
 
     @commands.group(name="job", invoke_without_command=True)
     async def job(self, ctx):
@@ -21,12 +39,15 @@ class JobSystem:
         if currency not in guild_data["currencies"]:
             await ctx.send(f"Currency {currency} does not exist.")
             return
-        guild_data["jobs"][name] = {
+        # Journaled, as the payroll journals next_pay changes to this job
+        self.economy.apply(ctx.guild.id, "set", ["jobs", name], {
             "salary": salary,
             "currency": currency,
             "interval": interval,
-            "employees": []
-        }
+            "employees": [],
+            "next_pay": time.time() + max(interval, 1) * 60
+        })
+        self.schedule_job(str(ctx.guild.id), name, guild_data["jobs"][name]["next_pay"])
         await ctx.send(f"Job {name} created with salary {salary} {currency} every {interval} minutes.")
 
     @job.command(name="apply")
@@ -40,6 +61,7 @@ class JobSystem:
             await ctx.send("You are already employed in this job.")
             return
         guild_data["jobs"][name]["employees"].append(user_id)
+        self.economy.mark_dirty(ctx.guild.id, "jobs")
         await ctx.send(f"You have been employed as {name}.")
 
     @job.command(name="list")
@@ -65,13 +87,103 @@ class JobSystem:
             await ctx.send("You are not employed in this job.")
             return
         guild_data["jobs"][name]["employees"].remove(user_id)
+        self.economy.mark_dirty(ctx.guild.id, "jobs")
         await ctx.send(f"You have quit your job as {name}.")
 
+    def schedule_job(self, guild_id, name, due):
+        if self.payroll_index.get(guild_id, {}).get(name) == due:
+            return
+        heapq.heappush(self.payroll, (due, guild_id, name))
+        self.payroll_index.setdefault(guild_id, {})[name] = due
+        self.payroll_changed = True
+        # Wake the payroll loop when this is now the earliest payday
+        if self.payroll[0][0] == due:
+            self.payroll_wakeup.set()
+
+    def schedule_guild(self, guild_id, guild_data):
+        """Put a freshly loaded guild's jobs on the payroll heap, e.g. when the payroll file was lost."""
+        for name, job_data in guild_data["jobs"].items():
+            if "next_pay" not in job_data:
+                # Jobs created before scheduled payroll start their first interval now
+                self.economy.apply(guild_id, "set", ["jobs", name, "next_pay"], time.time() + max(job_data["interval"], 1) * 60)
+            self.schedule_job(guild_id, name, job_data["next_pay"])
+
+    def start_payroll(self):
+        if self.payroll_task is None or self.payroll_task.done():
+            self.payroll_task = asyncio.create_task(self.payroll_loop())
+
+    def read_payroll(self):
+        if not os.path.exists(PAYROLL_FILE):
+            return {}
+        with open(PAYROLL_FILE, 'r') as f:
+            return json.load(f)
+
+    async def load_payroll(self):
+        # Only the file read runs in a thread, the heap is only ever changed on the event loop
+        payroll = await asyncio.to_thread(self.read_payroll)
+        changed = self.payroll_changed
+        for guild_id, jobs in payroll.items():
+            for name, due in jobs.items():
+                self.schedule_job(guild_id, name, due)
+        # Entries read from the file are already saved, guilds scheduled meanwhile may not be
+        self.payroll_changed = changed
+
+    async def save_payroll(self):
+        if not self.payroll_changed:
+            return
+        self.payroll_changed = False
+        payload = json.dumps(self.payroll_index)
+        try:
+            await asyncio.to_thread(atomic_write, PAYROLL_FILE, payload)
+        except Exception as e:
+            print(f"Failed to save payroll schedule: {e}")
+            self.payroll_changed = True
+
+    async def payroll_loop(self):
+        await self.load_payroll()
+        while True:
+            await self.save_payroll()
+            delay = self.payroll[0][0] - time.time() if self.payroll else None
+            if delay is not None and delay <= 0:
+                await self.process_salaries()
+                continue
+            self.payroll_wakeup.clear()
+            try:
+                await asyncio.wait_for(self.payroll_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
     async def process_salaries(self):
-        for guild in self.bot.guilds:
-            guild_data = self.economy.get_guild_data(guild.id)
-            for job_name, job_data in guild_data["jobs"].items():
-                for employee_id in job_data["employees"]:
-                    if employee_id not in guild_data["wallets"]:
-                        guild_data["wallets"][employee_id] = {cur: 0 for cur in guild_data["currencies"]}
-                    guild_data["wallets"][employee_id][job_data["currency"]] += job_data["salary"]
+        """Pay every job whose payday has passed; jobs that are not due are never touched."""
+        now = time.time()
+        while self.payroll and self.payroll[0][0] <= now:
+            due, guild_id, name = heapq.heappop(self.payroll)
+            try:
+                guild_data = await self.economy.load_guild(guild_id)
+            except Exception as e:
+                print(f"Failed to load economy data for guild {guild_id}, retrying its payroll later: {e}")
+                if self.payroll_index.get(guild_id, {}).get(name) == due:
+                    self.schedule_job(guild_id, name, now + PAYROLL_RETRY)
+                continue
+            if self.payroll_index.get(guild_id, {}).get(name) != due:
+                # Superseded by a newer heap entry, e.g. the guild's own schedule on load
+                continue
+            job_data = guild_data["jobs"].get(name)
+            if job_data is None:
+                del self.payroll_index[guild_id][name]
+                self.payroll_changed = True
+                continue
+            if job_data["next_pay"] > now:
+                self.schedule_job(guild_id, name, job_data["next_pay"])
+                continue
+            self.pay_job(guild_id, name, job_data, now)
+
+    def pay_job(self, guild_id, name, job_data, now):
+        # Paydays missed while the bot was offline are paid together as one credit
+        interval = max(job_data["interval"], 1) * 60
+        ticks = int((now - job_data["next_pay"]) // interval) + 1
+        for employee_id in job_data["employees"]:
+            self.economy.balances.add(guild_id, employee_id, job_data["currency"], job_data["salary"] * ticks)
+        next_pay = job_data["next_pay"] + ticks * interval
+        self.economy.apply(guild_id, "set", ["jobs", name, "next_pay"], next_pay)
+        self.schedule_job(guild_id, name, next_pay)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import threading
+from .storage import DATA_DIR, atomic_write
+
+# Seconds journal records are buffered before one batched write + fsync
+GROUP_COMMIT_INTERVAL = float(os.getenv('ECONOMY_GROUP_COMMIT_INTERVAL', '0.2'))
+
+
+def scale_numbers(container, factor):
+    """Multiply every number nested in container by factor."""
+    if hasattr(container, "scale"):
+        # ColumnarWallets scales its whole matrix at once
+        container.scale(factor)
+        return
+    for key, value in container.items():
+        if isinstance(value, dict):
+            scale_numbers(value, factor)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            container[key] = value * factor
+
+
+def apply_record(data, op, path, value=None):
+    """Apply one journal operation to a guild dict.
+
+    ops: add (numeric delta), set, del, push (append to list), pull (remove from list),
+    scale (multiply every number under path, for taxes and interest)
+    """
+    target = data
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    last = path[-1]
+    if op == "add":
+        target[last] = target.get(last, 0) + value
+    elif op == "set":
+        target[last] = value
+    elif op == "del":
+        target.pop(last, None)
+    elif op == "push":
+        target.setdefault(last, []).append(value)
+    elif op == "pull":
+        items = target.get(last, [])
+        if value in items:
+            items.remove(value)
+    elif op == "scale":
+        if last in target:
+            scale_numbers(target[last], value)
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+class Journal:
+    """Append-only, per-guild log of economy mutations.
+
+    Records are [seq, op, path, value] JSON lines. They are buffered and written
+    in one fsync'd batch every GROUP_COMMIT_INTERVAL seconds. A snapshot stores the
+    last seq it contains as "journal_seq"; compaction then drops the records the
+    snapshot already covers and replay skips them.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.seq = {}
+        self.sizes = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.commit_task = None
+
+    def path(self, guild_id):
+        return os.path.join(self.data_dir, f'economy_{guild_id}.journal')
+
+    def record(self, guild_id, op, path, value=None):
+        guild_id = str(guild_id)
+        seq = self.seq.get(guild_id, 0) + 1
+        self.seq[guild_id] = seq
+        line = json.dumps([seq, op, path, value], separators=(',', ':')) + "\n"
+        self.pending.setdefault(guild_id, []).append(line)
+        self.sizes[guild_id] = self.sizes.get(guild_id, 0) + len(line)
+        if self.commit_task is None or self.commit_task.done():
+            self.commit_task = asyncio.create_task(self.commit_later())
+        return seq
+
+    async def commit_later(self):
+        await asyncio.sleep(GROUP_COMMIT_INTERVAL)
+        self.commit_task = None
+        await self.commit()
+
+    async def commit(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            await asyncio.to_thread(self.write_batches, pending)
+        except Exception as e:
+            print(f"Failed to write economy journal: {e}")
+            for guild_id, lines in pending.items():
+                self.pending[guild_id] = lines + self.pending.get(guild_id, [])
+            if self.commit_task is None or self.commit_task.done():
+                self.commit_task = asyncio.create_task(self.commit_later())
+
+    def write_batches(self, pending):
+        with self.lock:
+            for guild_id, lines in pending.items():
+                filename = self.path(guild_id)
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                with open(filename, 'a') as f:
+                    f.write("".join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def replay(self, guild_id, data):
+        """Apply the journal tail newer than the snapshot's journal_seq to data."""
+        guild_id = str(guild_id)
+        last_seq = data.get("journal_seq", 0)
+        size = 0
+        filename = self.path(guild_id)
+        if os.path.exists(filename):
+            with self.lock:
+                with open(filename, 'r') as f:
+                    lines = f.readlines()
+                for index, line in enumerate(lines):
+                    try:
+                        seq, op, path, value = json.loads(line)
+                    except ValueError:
+                        # A torn final write from a crash; cut it off so new appends stay readable
+                        atomic_write(filename, "".join(lines[:index]))
+                        break
+                    size += len(line)
+                    if seq > last_seq:
+                        apply_record(data, op, path, value)
+                        last_seq = seq
+        self.seq[guild_id] = max(last_seq, self.seq.get(guild_id, 0))
+        self.sizes[guild_id] = size
+        return data
+
+    def compact(self, guild_id, snapshot_seq):
+        """Drop the records a written snapshot already contains, returning the bytes kept."""
+        guild_id = str(guild_id)
+        filename = self.path(guild_id)
+        with self.lock:
+            if not os.path.exists(filename):
+                return 0
+            with open(filename, 'r') as f:
+                kept = []
+                for line in f:
+                    try:
+                        seq = json.loads(line)[0]
+                    except ValueError:
+                        break
+                    if seq > snapshot_seq:
+                        kept.append(line)
+            atomic_write(filename, "".join(kept))
+        return sum(len(line) for line in kept)
@@ -0,0 +1,150 @@
+import os
+from bisect import bisect_left, insort
+
+# Entries per bucket of a RankedList before it is split in two
+BUCKET_SIZE = int(os.getenv('ECONOMY_RANK_BUCKET_SIZE', '512'))
+
+
+class RankedList:
+    """Sorted (-amount, user_id) entries, stored as a list of sorted buckets.
+
+    Inserts and removals bisect to a bucket and shift at most BUCKET_SIZE * 2
+    entries, rank() adds up the bucket lengths in front of the entry and top()
+    reads the first buckets only.
+    """
+
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self.buckets = [entries[i:i + BUCKET_SIZE] for i in range(0, len(entries), BUCKET_SIZE)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(entries)
+
+    def __len__(self):
+        return self.size
+
+    def locate(self, entry):
+        return min(bisect_left(self.maxes, entry), len(self.buckets) - 1)
+
+    def add(self, entry):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([entry])
+            self.maxes.append(entry)
+            return
+        index = self.locate(entry)
+        bucket = self.buckets[index]
+        insort(bucket, entry)
+        self.maxes[index] = bucket[-1]
+        if len(bucket) > BUCKET_SIZE * 2:
+            self.buckets[index:index + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self.maxes[index:index + 1] = [bucket[BUCKET_SIZE - 1], bucket[-1]]
+
+    def remove(self, entry):
+        index = self.locate(entry)
+        bucket = self.buckets[index]
+        del bucket[bisect_left(bucket, entry)]
+        self.size -= 1
+        if bucket:
+            self.maxes[index] = bucket[-1]
+        else:
+            del self.buckets[index]
+            del self.maxes[index]
+
+    def rank(self, entry):
+        """Number of entries ahead of entry."""
+        index = self.locate(entry)
+        return sum(len(bucket) for bucket in self.buckets[:index]) + bisect_left(self.buckets[index], entry)
+
+    def top(self, count):
+        entries = []
+        for bucket in self.buckets:
+            entries.extend(bucket[:count - len(entries)])
+            if len(entries) >= count:
+                break
+        return entries
+
+
+class Leaderboards:
+    """Per-guild, per-currency rankings kept up to date as balances change.
+
+    A ranking is built the first time it is asked for, then EconomySystem.apply
+    moves only the user whose balance changed. The net worth rankings count
+    bank deposits too. Changes that replace or scale a whole section (taxes,
+    interest) invalidate the guild, and the next query rebuilds.
+    """
+
+    def __init__(self, economy):
+        self.economy = economy
+        # guild_id -> {(currency, networth): (RankedList, {user_id: amount})}
+        self.indexes = {}
+
+    def amount(self, guild_data, user_id, currency, networth):
+        # None when the user has nowhere to hold the currency and should not be ranked
+        wallet = guild_data["wallets"].get(user_id)
+        total = wallet.get(currency, 0) if wallet is not None else None
+        if networth:
+            for bank_data in guild_data["banks"].values():
+                account = bank_data["accounts"].get(user_id)
+                if account is not None:
+                    total = (total or 0) + account.get(currency, 0)
+        return total
+
+    def index(self, guild_id, currency, networth=False):
+        guild_id = str(guild_id)
+        indexes = self.indexes.setdefault(guild_id, {})
+        key = (currency, networth)
+        if key not in indexes:
+            guild_data = self.economy.get_guild_data(guild_id)
+            user_ids = set(guild_data["wallets"])
+            if networth:
+                for bank_data in guild_data["banks"].values():
+                    user_ids.update(bank_data["accounts"])
+            amounts = {}
+            for user_id in user_ids:
+                amounts[user_id] = self.amount(guild_data, user_id, currency, networth)
+            indexes[key] = (RankedList((-amount, user_id) for user_id, amount in amounts.items()), amounts)
+        return indexes[key]
+
+    def changed(self, guild_id, path):
+        """Re-rank whoever the change at path affects, called after every journaled change."""
+        indexes = self.indexes.get(guild_id)
+        if not indexes or path[0] not in ("wallets", "banks"):
+            return
+        if path[0] == "wallets" and len(path) >= 2:
+            user_id, currency = path[1], path[2] if len(path) >= 3 else None
+        elif path[0] == "banks" and len(path) >= 4 and path[2] == "accounts":
+            user_id, currency = path[3], path[4] if len(path) >= 5 else None
+        else:
+            # A whole section or bank was replaced
+            self.invalidate(guild_id)
+            return
+        guild_data = self.economy.get_guild_data(guild_id)
+        for (indexed_currency, networth), (ranked, amounts) in indexes.items():
+            if path[0] == "banks" and not networth:
+                continue
+            # A user seen for the first time joins every ranking, other changes only touch their currency
+            if currency not in (None, indexed_currency) and user_id in amounts:
+                continue
+            old = amounts.pop(user_id, None)
+            if old is not None:
+                ranked.remove((-old, user_id))
+            new = self.amount(guild_data, user_id, indexed_currency, networth)
+            if new is not None:
+                amounts[user_id] = new
+                ranked.add((-new, user_id))
+
+    def invalidate(self, guild_id):
+        self.indexes.pop(str(guild_id), None)
+
+    def top(self, guild_id, currency, count, networth=False):
+        """The count largest amounts as (user_id, amount), largest first."""
+        ranked, _ = self.index(guild_id, currency, networth)
+        return [(user_id, -negative) for negative, user_id in ranked.top(count)]
+
+    def rank(self, guild_id, user_id, currency, networth=False):
+        """(1-based position, amount, ranked users), or None when the user is not ranked."""
+        ranked, amounts = self.index(guild_id, currency, networth)
+        amount = amounts.get(str(user_id))
+        if amount is None:
+            return None
+        return ranked.rank((-amount, str(user_id))) + 1, amount, len(ranked)
@@ -19,16 +19,14 @@ class LoanSystem:
             await ctx.send(f"Currency {currency} does not exist.")
             return
         user_id = str(ctx.author.id)
-        if "loans" not in guild_data:
-            guild_data["loans"] = {}
-        if user_id in guild_data["loans"]:
+        if user_id in guild_data.get("loans", {}):
             await ctx.send("You already have an outstanding loan.")
             return
-        guild_data["loans"][user_id] = {
+        self.economy.apply(ctx.guild.id, "set", ["loans", user_id], {
             "amount": amount,
             "currency": currency,
             "status": "pending"
-        }
+        })
         await ctx.send(f"Loan request for {amount} {currency} submitted for approval.")
 
     @loan.command(name="approve")
@@ -45,17 +43,18 @@ class LoanSystem:
         if guild_data["loans"][user_id]["status"] != "pending":
             await ctx.send("This loan is not pending approval.")
             return
-        guild_data["loans"][user_id]["status"] = "approved"
-        guild_data["loans"][user_id]["interest"] = interest
-        guild_data["loans"][user_id]["term"] = term
-        guild_data["loans"][user_id]["due_date"] = (datetime.now() + timedelta(days=term)).isoformat()
+        self.economy.apply(ctx.guild.id, "set", ["loans", user_id], {
+            **guild_data["loans"][user_id],
+            "status": "approved",
+            "interest": interest,
+            "term": term,
+            "due_date": (datetime.now() + timedelta(days=term)).isoformat()
+        })
         
         currency = guild_data["loans"][user_id]["currency"]
         amount = guild_data["loans"][user_id]["amount"]
         
-        if user_id not in guild_data["wallets"]:
-            guild_data["wallets"][user_id] = {cur: 0 for cur in guild_data["currencies"]}
-        guild_data["wallets"][user_id][currency] += amount
+        self.economy.balances.add(ctx.guild.id, user_id, currency, amount)
         
         await ctx.send(f"Loan approved for {user.name}. {amount} {currency} has been added to their wallet.")
 
@@ -75,15 +74,15 @@ class LoanSystem:
             return
         
         currency = loan["currency"]
-        if guild_data["wallets"][user_id][currency] < amount:
+        if self.economy.balances.get(ctx.guild.id, user_id, currency) < amount:
             await ctx.send("Insufficient funds to make this repayment.")
             return
         
-        guild_data["wallets"][user_id][currency] -= amount
-        loan["amount"] -= amount
+        self.economy.balances.add(ctx.guild.id, user_id, currency, -amount)
+        self.economy.credit(ctx.guild.id, ["loans", user_id, "amount"], -amount)
         
         if loan["amount"] <= 0:
-            del guild_data["loans"][user_id]
+            self.economy.apply(ctx.guild.id, "del", ["loans", user_id])
             await ctx.send("Loan fully repaid!")
         else:
             await ctx.send(f"Repayment of {amount} {currency} made. Remaining balance: {loan['amount']} {currency}")
@@ -119,5 +118,5 @@ class LoanSystem:
                     if datetime.now() > due_date:
                         # Apply penalty or take other actions for overdue loans
                         penalty = loan_data["amount"] * 0.1  # 10% penalty for example
-                        loan_data["amount"] += penalty
+                        self.economy.credit(guild.id, ["loans", user_id, "amount"], penalty)
                         # You might want to notify the user or take other actions here
@@ -1,15 +1,83 @@
+import heapq
+import time
 import discord
 from discord.ext import commands
+from .trades import new_trade_stats, record_trade
+
+# Most orders shown by !market browse, an embed holds 25 fields
+BROWSE_LIMIT = 25
+
+
+def upgrade_markets(data):
+    """Convert markets saved with a listings list to listings keyed by order ID.
+
+    Old listing IDs were len(listings) and could repeat; repeats get fresh IDs.
+    Every old listing is an ask.
+    """
+    for market_data in data.get("markets", {}).values():
+        listings = market_data.get("listings", {})
+        if isinstance(listings, dict) and "next_id" in market_data:
+            continue
+        orders = list(listings.values()) if isinstance(listings, dict) else listings
+        next_id = max((order["id"] for order in orders if isinstance(order.get("id"), int)), default=-1) + 1
+        upgraded = {}
+        for order in orders:
+            order.setdefault("side", "ask")
+            if not isinstance(order.get("id"), int) or str(order["id"]) in upgraded:
+                order["id"] = next_id
+                next_id += 1
+            upgraded[str(order["id"])] = order
+        market_data["listings"] = upgraded
+        market_data["next_id"] = next_id
+    return data
+
+
+class OrderBook:
+    """Price-ordered heaps of open order IDs per (side, item, currency).
+
+    Asks are keyed by (price, id) and bids by (-price, id), so the top of each
+    heap is the best price and the oldest order at that price. Filled and
+    cancelled orders only leave the listings dict; their heap entries are
+    dropped when they reach the top.
+    """
+
+    def __init__(self, listings):
+        self.heaps = {}
+        for order in listings.values():
+            self.heaps.setdefault(self.key(order), []).append(self.entry(order))
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def key(self, order):
+        return (order["side"], order["item"], order["currency"])
+
+    def entry(self, order):
+        return (order["price"] if order["side"] == "ask" else -order["price"], order["id"])
+
+    def push(self, order):
+        heapq.heappush(self.heaps.setdefault(self.key(order), []), self.entry(order))
+
+    def best(self, listings, side, item, currency):
+        heap = self.heaps.get((side, item, currency))
+        while heap:
+            order = listings.get(str(heap[0][1]))
+            if order is not None:
+                return order
+            heapq.heappop(heap)
+        return None
+
 
 class MarketSystem:
     def __init__(self, economy):
         self.economy = economy
         self.bot = economy.bot
+        # (guild_id, market) -> OrderBook, built on first use
+        self.books = {}
 
     @commands.group(name="market", invoke_without_command=True)
     async def market(self, ctx):
         """Market commands"""
-        await ctx.send("Available commands: create, list, buy, browse")
+        await ctx.send("Available commands: create, sell, bid, buy, cancel, browse")
 
     @market.command(name="create")
     @commands.has_permissions(administrator=True)
@@ -18,75 +86,195 @@ class MarketSystem:
         if name in guild_data["markets"]:
             await ctx.send(f"Market {name} already exists.")
             return
-        guild_data["markets"][name] = {"listings": []}
+        self.economy.apply(ctx.guild.id, "set", ["markets", name], {"listings": {}, "next_id": 0})
         await ctx.send(f"Market {name} created.")
 
-    @market.command(name="list")
-    async def market_list(self, ctx, market: str, item: str, amount: int, price: float, currency: str):
-        guild_data = self.economy.get_guild_data(ctx.guild.id)
+    def book(self, guild_id, market):
+        key = (str(guild_id), market)
+        if key not in self.books:
+            self.books[key] = OrderBook(self.economy.get_guild_data(guild_id)["markets"][market]["listings"])
+        return self.books[key]
+
+    def forget(self, guild_id):
+        for key in [key for key in self.books if key[0] == str(guild_id)]:
+            del self.books[key]
+
+    def place(self, guild_id, market, side, user_id, item, amount, price, currency):
+        guild_data = self.economy.get_guild_data(guild_id)
+        order_id = guild_data["markets"][market]["next_id"]
+        self.economy.apply(guild_id, "add", ["markets", market, "next_id"], 1)
+        order = {
+            "id": order_id,
+            "side": side,
+            "seller" if side == "ask" else "buyer": user_id,
+            "item": item,
+            "amount": amount,
+            "price": price,
+            "currency": currency
+        }
+        self.economy.apply(guild_id, "set", ["markets", market, "listings", str(order_id)], order)
+        self.book(guild_id, market).push(guild_data["markets"][market]["listings"][str(order_id)])
+        return order_id
+
+    def fill(self, guild_id, market, order, amount):
+        """Trade amount units of a resting order at its price and settle both sides."""
+        total = amount * order["price"]
+        path = ["markets", market, "listings", str(order["id"])]
+        if order["side"] == "ask":
+            # The taker's money was escrowed by the caller, the seller's items when the ask was placed
+            self.economy.balances.add(guild_id, order["seller"], order["currency"], total)
+        else:
+            self.economy.credit(guild_id, ["inventories", order["buyer"], order["item"]], amount)
+        self.record_trade(guild_id, market, order["item"], order["currency"], order["price"], amount)
+        if amount >= order["amount"]:
+            self.economy.apply(guild_id, "del", path)
+        else:
+            self.economy.credit(guild_id, path + ["amount"], -amount)
+        return total
+
+    def record_trade(self, guild_id, market, item, currency, price, amount):
+        # Trade statistics are derived data, saved with the next flush rather than journaled
+        history = self.economy.get_guild_data(guild_id).setdefault("trade_history", {})
+        by_currency = history.setdefault(market, {}).setdefault(item, {})
+        if currency not in by_currency:
+            by_currency[currency] = new_trade_stats()
+        record_trade(by_currency[currency], time.time(), price, amount)
+        self.economy.mark_dirty(guild_id, "trade_history")
+
+    def validate(self, guild_data, market, item, amount, price, currency):
         if market not in guild_data["markets"]:
-            await ctx.send(f"Market {market} does not exist.")
-            return
+            return f"Market {market} does not exist."
         if item not in guild_data["items"]:
-            await ctx.send(f"Item {item} does not exist.")
-            return
+            return f"Item {item} does not exist."
         if currency not in guild_data["currencies"]:
-            await ctx.send(f"Currency {currency} does not exist.")
+            return f"Currency {currency} does not exist."
+        if amount <= 0 or price <= 0:
+            return "Amount and price must be positive."
+        return None
+
+    @market.command(name="sell", aliases=["list"])
+    async def market_sell(self, ctx, market: str, item: str, amount: int, price: float, currency: str):
+        """Sell amount of an item for at least price each; the unsold rest stays listed."""
+        guild_data = self.economy.get_guild_data(ctx.guild.id)
+        error = self.validate(guild_data, market, item, amount, price, currency)
+        if error:
+            await ctx.send(error)
             return
-        
+
         user_id = str(ctx.author.id)
-        if "inventories" not in guild_data:
-            guild_data["inventories"] = {}
-        if user_id not in guild_data["inventories"]:
-            guild_data["inventories"][user_id] = {}
-        
-        if guild_data["inventories"][user_id].get(item, 0) < amount:
+        if guild_data.get("inventories", {}).get(user_id, {}).get(item, 0) < amount:
             await ctx.send("You don't have enough of this item to list.")
             return
-        
-        listing_id = len(guild_data["markets"][market]["listings"])
-        guild_data["markets"][market]["listings"].append({
-            "id": listing_id,
-            "seller": user_id,
-            "item": item,
-            "amount": amount,
-            "price": price,
-            "currency": currency
-        })
-        guild_data["inventories"][user_id][item] -= amount
-        await ctx.send(f"Listed {amount} {item} for {price} {currency} in {market}. Listing ID: {listing_id}")
+
+        self.economy.credit(ctx.guild.id, ["inventories", user_id, item], -amount)
+        listings = guild_data["markets"][market]["listings"]
+        book = self.book(ctx.guild.id, market)
+        remaining, received = amount, 0
+        while remaining:
+            bid = book.best(listings, "bid", item, currency)
+            if bid is None or bid["price"] < price:
+                break
+            units = min(remaining, bid["amount"])
+            received += self.fill(ctx.guild.id, market, bid, units)
+            remaining -= units
+        if received:
+            self.economy.balances.add(ctx.guild.id, user_id, currency, received)
+
+        sold = f"Sold {amount - remaining} {item} for {received} {currency}. " if remaining < amount else ""
+        if remaining:
+            order_id = self.place(ctx.guild.id, market, "ask", user_id, item, remaining, price, currency)
+            await ctx.send(f"{sold}Listed {remaining} {item} for {price} {currency} each in {market}. Listing ID: {order_id}")
+        else:
+            await ctx.send(sold.strip())
+
+    @market.command(name="bid")
+    async def market_bid(self, ctx, market: str, item: str, amount: int, price: float, currency: str):
+        """Buy amount of an item for at most price each, cheapest first; the unfilled rest stays as a bid."""
+        guild_data = self.economy.get_guild_data(ctx.guild.id)
+        error = self.validate(guild_data, market, item, amount, price, currency)
+        if error:
+            await ctx.send(error)
+            return
+
+        user_id = str(ctx.author.id)
+        balances = self.economy.balances
+        if balances.get(ctx.guild.id, user_id, currency) < amount * price:
+            await ctx.send("Insufficient funds.")
+            return
+
+        # The whole bid is escrowed up front; fills below the bid price are refunded the difference
+        balances.add(ctx.guild.id, user_id, currency, -amount * price)
+        listings = guild_data["markets"][market]["listings"]
+        book = self.book(ctx.guild.id, market)
+        remaining, spent = amount, 0
+        while remaining:
+            ask = book.best(listings, "ask", item, currency)
+            if ask is None or ask["price"] > price:
+                break
+            units = min(remaining, ask["amount"])
+            spent += self.fill(ctx.guild.id, market, ask, units)
+            remaining -= units
+        bought = amount - remaining
+        if bought:
+            self.economy.credit(ctx.guild.id, ["inventories", user_id, item], bought)
+            balances.add(ctx.guild.id, user_id, currency, bought * price - spent)
+
+        filled = f"Bought {bought} {item} for {spent} {currency}. " if bought else ""
+        if remaining:
+            order_id = self.place(ctx.guild.id, market, "bid", user_id, item, remaining, price, currency)
+            await ctx.send(f"{filled}Bid {price} {currency} each for {remaining} {item} in {market}. Bid ID: {order_id}")
+        else:
+            await ctx.send(filled.strip())
 
     @market.command(name="buy")
-    async def market_buy(self, ctx, market: str, listing_id: int):
+    async def market_buy(self, ctx, market: str, listing_id: int, amount: int = None):
         guild_data = self.economy.get_guild_data(ctx.guild.id)
         if market not in guild_data["markets"]:
             await ctx.send(f"Market {market} does not exist.")
             return
-        
-        listings = guild_data["markets"][market]["listings"]
-        listing = next((l for l in listings if l["id"] == listing_id), None)
-        if not listing:
+
+        listing = guild_data["markets"][market]["listings"].get(str(listing_id))
+        if not listing or listing["side"] != "ask":
             await ctx.send("Listing not found.")
             return
-        
+        amount = listing["amount"] if amount is None else amount
+        if amount <= 0 or amount > listing["amount"]:
+            await ctx.send(f"This listing has {listing['amount']} {listing['item']} for sale.")
+            return
+
         buyer_id = str(ctx.author.id)
-        if buyer_id not in guild_data["wallets"]:
-            guild_data["wallets"][buyer_id] = {cur: 0 for cur in guild_data["currencies"]}
-        if "inventories" not in guild_data:
-            guild_data["inventories"] = {}
-        if buyer_id not in guild_data["inventories"]:
-            guild_data["inventories"][buyer_id] = {}
-        
-        if guild_data["wallets"][buyer_id][listing["currency"]] < listing["price"]:
+        balances = self.economy.balances
+        cost = amount * listing["price"]
+        if balances.get(ctx.guild.id, buyer_id, listing["currency"]) < cost:
             await ctx.send("Insufficient funds.")
             return
-        
-        guild_data["wallets"][buyer_id][listing["currency"]] -= listing["price"]
-        guild_data["wallets"][listing["seller"]][listing["currency"]] += listing["price"]
-        guild_data["inventories"][buyer_id][listing["item"]] = guild_data["inventories"][buyer_id].get(listing["item"], 0) + listing["amount"]
-        
-        listings.remove(listing)
-        await ctx.send(f"Bought {listing['amount']} {listing['item']} for {listing['price']} {listing['currency']}")
+
+        item, currency = listing["item"], listing["currency"]
+        balances.add(ctx.guild.id, buyer_id, currency, -cost)
+        self.fill(ctx.guild.id, market, listing, amount)
+        self.economy.credit(ctx.guild.id, ["inventories", buyer_id, item], amount)
+        await ctx.send(f"Bought {amount} {item} for {cost} {currency}")
+
+    @market.command(name="cancel")
+    async def market_cancel(self, ctx, market: str, order_id: int):
+        guild_data = self.economy.get_guild_data(ctx.guild.id)
+        if market not in guild_data["markets"]:
+            await ctx.send(f"Market {market} does not exist.")
+            return
+
+        order = guild_data["markets"][market]["listings"].get(str(order_id))
+        user_id = str(ctx.author.id)
+        if not order or order.get("seller", order.get("buyer")) != user_id:
+            await ctx.send("You have no open order with that ID.")
+            return
+
+        # Return whatever is still escrowed
+        if order["side"] == "ask":
+            self.economy.credit(ctx.guild.id, ["inventories", user_id, order["item"]], order["amount"])
+        else:
+            self.economy.balances.add(ctx.guild.id, user_id, order["currency"], order["amount"] * order["price"])
+        self.economy.apply(ctx.guild.id, "del", ["markets", market, "listings", str(order_id)])
+        await ctx.send(f"Cancelled order {order_id}.")
 
     @market.command(name="browse")
     async def market_browse(self, ctx, market: str):
@@ -94,17 +282,20 @@ class MarketSystem:
         if market not in guild_data["markets"]:
             await ctx.send(f"Market {market} does not exist.")
             return
-        
+
         listings = guild_data["markets"][market]["listings"]
         if not listings:
             await ctx.send("No active listings in this market.")
             return
-        
+
         embed = discord.Embed(title=f"Market Listings: {market}", color=discord.Color.blue())
-        for listing in listings:
+        for listing in list(listings.values())[:BROWSE_LIMIT]:
+            side = "Bid" if listing["side"] == "bid" else "ID"
             embed.add_field(
-                name=f"ID: {listing['id']} - {listing['item']}",
-                value=f"Amount: {listing['amount']}, Price: {listing['price']} {listing['currency']}",
+                name=f"{side}: {listing['id']} - {listing['item']}",
+                value=f"Amount: {listing['amount']}, Price: {listing['price']} {listing['currency']} each",
                 inline=False
             )
+        if len(listings) > BROWSE_LIMIT:
+            embed.set_footer(text=f"Showing {BROWSE_LIMIT} of {len(listings)} orders")
         await ctx.send(embed=embed)
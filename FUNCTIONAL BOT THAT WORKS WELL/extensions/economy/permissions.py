@@ -13,6 +13,7 @@ class PermissionSystem:
         if "eco_roles" not in guild_data:
             guild_data["eco_roles"] = {}
         guild_data["eco_roles"][str(user.id)] = role
+        self.economy.mark_dirty(ctx.guild.id, "eco_roles")
         await ctx.send(f"Assigned economic role '{role}' to {user.name}")
 
     def check_permission(self, ctx, required_role):
@@ -25,6 +25,7 @@ class ResourceSystem:
             "max_amount": max_amount,
             "last_update": datetime.now().isoformat()
         }
+        self.economy.mark_dirty(ctx.guild.id, "resources")
         await ctx.send(f"Resource {name} created with regen rate {regen_rate} and max amount {max_amount}.")
 
     @resource.command(name="info")
@@ -35,6 +36,7 @@ class ResourceSystem:
             return
         resource = guild_data["resources"][name]
         self.update_resource(guild_data, name)
+        self.economy.mark_dirty(ctx.guild.id, "resources")
         embed = discord.Embed(title=f"Resource Info: {name}", color=discord.Color.blue())
         embed.add_field(name="Amount", value=f"{resource['amount']:.2f}")
         embed.add_field(name="Regeneration Rate", value=f"{resource['regen_rate']:.2f}")
@@ -58,6 +60,7 @@ class ResourceSystem:
             guild_data["inventories"][user_id] = {}
         guild_data["resources"][resource]["amount"] -= amount
         guild_data["inventories"][user_id][resource] = guild_data["inventories"][user_id].get(resource, 0) + amount
+        self.economy.mark_dirty(ctx.guild.id, "resources", "inventories")
         await ctx.send(f"Gathered {amount} {resource}.")
 
     def update_resource(self, guild_data, resource):
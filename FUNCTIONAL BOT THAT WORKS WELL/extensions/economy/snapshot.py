@@ -0,0 +1,413 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+from .storage import DATA_DIR, JSONStorage, StorageBackend, atomic_write
+
+# File layout:
+#   MAGIC | u32 section count | index: (u16 name length, name, u8 kind, u64 offset, u64 length)...
+#   | section bodies
+# Numeric sections are fixed-width rows whose string columns point into the shared
+# string table section, so user IDs, currency and item names are stored once.
+MAGIC = b"ECOSNAP1"
+# LISTINGS is the list-shaped asks-only layout, still read from older snapshots
+STRINGS, JSON, BALANCES, ACCOUNTS, LISTINGS, ORDERS = range(6)
+STRING_TABLE = "__strings__"
+
+COUNT = struct.Struct("<I")
+NAME_LENGTH = struct.Struct("<H")
+INDEX_ENTRY = struct.Struct("<BQQ")
+# outer key, inner key, value, value is int
+BALANCE_ROW = struct.Struct("<IIdB")
+# bank, user, currency, value, value is int
+ACCOUNT_ROW = struct.Struct("<IIIdB")
+# market, id, seller, item, amount, amount is int, price, price is int, currency
+LISTING_ROW = struct.Struct("<IqIIdBdBI")
+# market, id, side, seller or buyer, item, amount, amount is int, price, price is int, currency
+ORDER_ROW = struct.Struct("<IqBIIdBdBI")
+# Stands in for the inner key of an empty wallet/inventory/account
+NO_KEY = 0xFFFFFFFF
+ORDER_SIDES = ("ask", "bid")
+# The user key of each side, "seller" for asks and "buyer" for bids
+ORDER_USERS = ("seller", "buyer")
+ORDER_KEYS = [{"id", "side", user, "item", "amount", "price", "currency"} for user in ORDER_USERS]
+
+
+class Unencodable(Exception):
+    """A section holds values the fixed-width layout can't represent; it is stored as JSON."""
+
+
+class StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            raise Unencodable(value)
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def encode(self):
+        parts = [COUNT.pack(len(self.strings))]
+        for value in self.strings:
+            raw = value.encode('utf-8')
+            parts.append(COUNT.pack(len(raw)))
+            parts.append(raw)
+        return b"".join(parts)
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise Unencodable(value)
+    if isinstance(value, int) and abs(value) >= 2 ** 53:
+        raise Unencodable(value)
+    return float(value), isinstance(value, int)
+
+
+def _value(number, is_int):
+    return int(number) if is_int else number
+
+
+def _encode_balances(section, strings):
+    rows = []
+    for outer, entries in section.items():
+        outer_id = strings.intern(outer)
+        if not isinstance(entries, dict):
+            raise Unencodable(entries)
+        if not entries:
+            rows.append(BALANCE_ROW.pack(outer_id, NO_KEY, 0.0, 0))
+        for inner, value in entries.items():
+            rows.append(BALANCE_ROW.pack(outer_id, strings.intern(inner), *_number(value)))
+    return b"".join(rows)
+
+
+def _encode_accounts(banks, strings):
+    rows = []
+    for bank, bank_data in banks.items():
+        bank_id = strings.intern(bank)
+        for user_id, account in bank_data.get("accounts", {}).items():
+            user_index = strings.intern(user_id)
+            if not isinstance(account, dict):
+                raise Unencodable(account)
+            if not account:
+                rows.append(ACCOUNT_ROW.pack(bank_id, user_index, NO_KEY, 0.0, 0))
+            for currency, value in account.items():
+                rows.append(ACCOUNT_ROW.pack(bank_id, user_index, strings.intern(currency), *_number(value)))
+    return b"".join(rows)
+
+
+def _encode_orders(markets, strings):
+    rows = []
+    for market, market_data in markets.items():
+        market_id = strings.intern(market)
+        listings = market_data.get("listings", {})
+        if not isinstance(listings, dict):
+            raise Unencodable(listings)
+        for key, order in listings.items():
+            if order.get("side") not in ORDER_SIDES:
+                raise Unencodable(order)
+            side = ORDER_SIDES.index(order["side"])
+            if set(order) != ORDER_KEYS[side] or isinstance(order["id"], bool) or not isinstance(order["id"], int) \
+                    or key != str(order["id"]):
+                raise Unencodable(order)
+            rows.append(ORDER_ROW.pack(
+                market_id, order["id"], side, strings.intern(order[ORDER_USERS[side]]), strings.intern(order["item"]),
+                *_number(order["amount"]), *_number(order["price"]), strings.intern(order["currency"])
+            ))
+    return b"".join(rows)
+
+
+def _json(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def encode_snapshot(data):
+    strings = StringTable()
+    sections = []
+    for name, value in data.items():
+        try:
+            if name in ("wallets", "inventories"):
+                sections.append((name, BALANCES, _encode_balances(value, strings)))
+                continue
+            if name == "banks":
+                accounts = _encode_accounts(value, strings)
+                meta = {bank: {k: v for k, v in bank_data.items() if k != "accounts"} for bank, bank_data in value.items()}
+                sections.append((name, JSON, _json(meta)))
+                sections.append((f"{name}/accounts", ACCOUNTS, accounts))
+                continue
+            if name == "markets":
+                orders = _encode_orders(value, strings)
+                meta = {market: {k: v for k, v in market_data.items() if k != "listings"} for market, market_data in value.items()}
+                sections.append((name, JSON, _json(meta)))
+                sections.append((f"{name}/listings", ORDERS, orders))
+                continue
+        except (Unencodable, AttributeError):
+            pass
+        sections.append((name, JSON, _json(value)))
+    sections.append((STRING_TABLE, STRINGS, strings.encode()))
+
+    header_size = len(MAGIC) + COUNT.size + sum(
+        NAME_LENGTH.size + len(name.encode('utf-8')) + INDEX_ENTRY.size for name, _, _ in sections
+    )
+    header = [MAGIC, COUNT.pack(len(sections))]
+    offset = header_size
+    for name, kind, body in sections:
+        raw_name = name.encode('utf-8')
+        header.append(NAME_LENGTH.pack(len(raw_name)) + raw_name + INDEX_ENTRY.pack(kind, offset, len(body)))
+        offset += len(body)
+    return b"".join(header + [body for _, _, body in sections])
+
+
+class Snapshot:
+    """A memory-mapped snapshot file whose sections are decoded on request."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an economy snapshot")
+        position = len(MAGIC)
+        (count,) = COUNT.unpack_from(self.map, position)
+        position += COUNT.size
+        self.index = {}
+        for _ in range(count):
+            (name_length,) = NAME_LENGTH.unpack_from(self.map, position)
+            position += NAME_LENGTH.size
+            name = self.map[position:position + name_length].decode('utf-8')
+            position += name_length
+            self.index[name] = INDEX_ENTRY.unpack_from(self.map, position)
+            position += INDEX_ENTRY.size
+        self.strings = None
+
+    @property
+    def sections(self):
+        return [name for name in self.index if name != STRING_TABLE and "/" not in name]
+
+    def body(self, name):
+        _, offset, length = self.index[name]
+        return self.map[offset:offset + length]
+
+    def string_table(self):
+        if self.strings is None:
+            body = self.body(STRING_TABLE)
+            (count,) = COUNT.unpack_from(body, 0)
+            position = COUNT.size
+            self.strings = []
+            for _ in range(count):
+                (length,) = COUNT.unpack_from(body, position)
+                position += COUNT.size
+                self.strings.append(body[position:position + length].decode('utf-8'))
+                position += length
+        return self.strings
+
+    def decode(self, name):
+        kind = self.index[name][0]
+        if kind == JSON:
+            value = json.loads(self.body(name))
+        elif kind == BALANCES:
+            strings = self.string_table()
+            value = {}
+            for outer, inner, number, is_int in BALANCE_ROW.iter_unpack(self.body(name)):
+                entries = value.setdefault(strings[outer], {})
+                if inner != NO_KEY:
+                    entries[strings[inner]] = int(number) if is_int else number
+        else:
+            raise ValueError(f"Section {name} can't be decoded on its own")
+
+        if f"{name}/accounts" in self.index:
+            for bank_data in value.values():
+                bank_data["accounts"] = {}
+            strings = self.string_table()
+            for bank, user_id, currency, number, is_int in ACCOUNT_ROW.iter_unpack(self.body(f"{name}/accounts")):
+                account = value[strings[bank]]["accounts"].setdefault(strings[user_id], {})
+                if currency != NO_KEY:
+                    account[strings[currency]] = _value(number, is_int)
+        if f"{name}/listings" in self.index and self.index[f"{name}/listings"][0] == LISTINGS:
+            for market_data in value.values():
+                market_data["listings"] = []
+            strings = self.string_table()
+            for row in LISTING_ROW.iter_unpack(self.body(f"{name}/listings")):
+                market, listing_id, seller, item, amount, amount_is_int, price, price_is_int, currency = row
+                value[strings[market]]["listings"].append({
+                    "id": listing_id,
+                    "seller": strings[seller],
+                    "item": strings[item],
+                    "amount": _value(amount, amount_is_int),
+                    "price": _value(price, price_is_int),
+                    "currency": strings[currency]
+                })
+        elif f"{name}/listings" in self.index:
+            for market_data in value.values():
+                market_data["listings"] = {}
+            strings = self.string_table()
+            for row in ORDER_ROW.iter_unpack(self.body(f"{name}/listings")):
+                market, order_id, side, user, item, amount, amount_is_int, price, price_is_int, currency = row
+                value[strings[market]]["listings"][str(order_id)] = {
+                    "id": order_id,
+                    "side": ORDER_SIDES[side],
+                    ORDER_USERS[side]: strings[user],
+                    "item": strings[item],
+                    "amount": _value(amount, amount_is_int),
+                    "price": _value(price, price_is_int),
+                    "currency": strings[currency]
+                }
+        return value
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+        self.file.close()
+
+
+class LazyGuildData(dict):
+    """Guild dict backed by a Snapshot; each section is decoded the first time it is touched."""
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+        self.pending = set(snapshot.sections)
+
+    def materialize(self, key=None):
+        keys = list(self.pending) if key is None else ([key] if key in self.pending else [])
+        for name in keys:
+            self.pending.discard(name)
+            dict.__setitem__(self, name, self.snapshot.decode(name))
+        if not self.pending and self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def __missing__(self, key):
+        if key in self.pending:
+            self.materialize(key)
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.pending or dict.__contains__(self, key)
+
+    def __setitem__(self, key, value):
+        self.pending.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.materialize(key)
+        dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        self.materialize(key)
+        return dict.get(self, key, default)
+
+    def setdefault(self, key, default=None):
+        self.materialize(key)
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *default):
+        self.materialize(key)
+        return dict.pop(self, key, *default)
+
+    def __iter__(self):
+        self.materialize()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        return len(self.pending) + dict.__len__(self)
+
+    def has_orders(self):
+        """Whether the markets are still undecoded and stored as orders, so need no upgrade."""
+        if "markets" not in self.pending:
+            return False
+        entry = self.snapshot.index.get("markets/listings")
+        return entry is not None and entry[0] == ORDERS
+
+    def keys(self):
+        self.materialize()
+        return dict.keys(self)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+
+class BinarySnapshotStorage(StorageBackend):
+    """data/economy_<guild>.snap files in the compact snapshot format.
+
+    Guilds without a snapshot yet are read from their JSON file.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.json = JSONStorage(data_dir)
+
+    def path(self, guild_id):
+        return os.path.join(self.data_dir, f'economy_{guild_id}.snap')
+
+    def load_guild(self, guild_id):
+        filename = self.path(guild_id)
+        if not os.path.exists(filename):
+            return self.json.load_guild(guild_id)
+        return LazyGuildData(Snapshot(filename))
+
+    def dump_guild(self, guild_id, data, sections=None):
+        if isinstance(data, LazyGuildData):
+            # Releases the mapping too, so the file can be replaced
+            data.materialize()
+        return encode_snapshot(data)
+
+    def write_guild(self, guild_id, payload):
+        atomic_write(self.path(guild_id), payload)
+
+
+def convert(data_dir):
+    storage = BinarySnapshotStorage(data_dir)
+    for filename in sorted(glob.glob(os.path.join(data_dir, 'economy_*.json'))):
+        guild_id = os.path.basename(filename)[len('economy_'):-len('.json')]
+        data = storage.json.load_guild(guild_id)
+        storage.save_guild(guild_id, data)
+        print(f"{guild_id}: {os.path.getsize(filename)} -> {os.path.getsize(storage.path(guild_id))} bytes")
+
+
+def compare(data_dir):
+    storage = BinarySnapshotStorage(data_dir)
+    print(f"{'guild':<22}{'json bytes':>12}{'snap bytes':>12}{'json ms':>10}{'open ms':>10}{'full ms':>10}")
+    for filename in sorted(glob.glob(os.path.join(data_dir, 'economy_*.json'))):
+        guild_id = os.path.basename(filename)[len('economy_'):-len('.json')]
+        snapshot_file = storage.path(guild_id)
+        if not os.path.exists(snapshot_file):
+            storage.save_guild(guild_id, storage.json.load_guild(guild_id))
+
+        start = time.perf_counter()
+        with open(filename, 'r') as f:
+            json.load(f)
+        json_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        lazy = storage.load_guild(guild_id)
+        open_ms = (time.perf_counter() - start) * 1000
+        lazy.materialize()
+        full_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{guild_id:<22}{os.path.getsize(filename):>12}{os.path.getsize(snapshot_file):>12}"
+              f"{json_ms:>10.2f}{open_ms:>10.2f}{full_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert economy JSON files to binary snapshots and compare them.")
+    parser.add_argument('command', choices=['convert', 'compare'])
+    parser.add_argument('data_dir', nargs='?', default=DATA_DIR)
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert(args.data_dir)
+    else:
+        compare(args.data_dir)
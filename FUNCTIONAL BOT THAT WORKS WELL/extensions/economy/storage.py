@@ -0,0 +1,323 @@
+import json
+import os
+import sqlite3
+import threading
+
+# Storage settings, overridable through the environment like DATA_FILE in the main bot
+DATA_DIR = os.getenv('ECONOMY_DATA_DIR', 'data')
+STORAGE_BACKEND = os.getenv('ECONOMY_STORAGE', 'json')
+DB_FILE = os.getenv('ECONOMY_DB_FILE', os.path.join(DATA_DIR, 'economy.db'))
+
+# Sections stored one row per entry, keyed by the entry's dict key
+KEYED_SECTIONS = ("wallets", "inventories", "loans", "jobs", "recipes")
+
+# table name -> key columns following guild_id
+TABLES = {
+    "sections": ("name",),
+    "wallets": ("user_id",),
+    "inventories": ("user_id",),
+    "banks": ("bank",),
+    "bank_accounts": ("bank", "user_id"),
+    "markets": ("market",),
+    "listings": ("market", "listing_id"),
+    "loans": ("user_id",),
+    "jobs": ("name",),
+    "recipes": ("name",),
+}
+
+
+def new_guild_data():
+    return {
+        "currencies": {},
+        "wallets": {},
+        "items": {},
+        "markets": {},
+        "jobs": {},
+        "banks": {},
+        "resources": {},
+        "recipes": {},
+        "loans": {},
+        "config": {},
+        "trade_history": {}
+    }
+
+
+class StorageBackend:
+    """Persistence interface used by EconomySystem.
+
+    Saving is split in two steps: dump_guild runs on the event loop and turns the
+    live guild dict into a self-contained payload, write_guild persists that payload
+    and is safe to run in a worker thread. When dump_guild is given the set of
+    dirty sections, only those sections are re-serialized.
+    """
+
+    def load_guild(self, guild_id):
+        raise NotImplementedError
+
+    def dump_guild(self, guild_id, data, sections=None):
+        raise NotImplementedError
+
+    def write_guild(self, guild_id, payload):
+        raise NotImplementedError
+
+    def save_guild(self, guild_id, data):
+        self.write_guild(guild_id, self.dump_guild(guild_id, data))
+
+    def forget(self, guild_id):
+        """Drop any per-guild caches once the guild is evicted from memory."""
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONStorage(StorageBackend):
+    """One data/economy_<guild>.json document per guild.
+
+    The serialized text of each top-level section is kept between saves, so a save
+    re-encodes only the dirty sections and the document is stitched together and
+    written in the worker thread.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.encoded = {}
+
+    def path(self, guild_id):
+        return os.path.join(self.data_dir, f'economy_{guild_id}.json')
+
+    def load_guild(self, guild_id):
+        filename = self.path(guild_id)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    def dump_guild(self, guild_id, data, sections=None):
+        guild_id = str(guild_id)
+        encoded = self.encoded.get(guild_id)
+        if encoded is None or sections is None:
+            encoded = {}
+            sections = list(data)
+        for section in sections:
+            if section in data:
+                encoded[section] = json.dumps(data[section])
+            else:
+                encoded.pop(section, None)
+        self.encoded[guild_id] = encoded
+        return list(encoded.items())
+
+    def forget(self, guild_id):
+        self.encoded.pop(str(guild_id), None)
+
+    def write_guild(self, guild_id, payload):
+        document = "{" + ", ".join(f"{json.dumps(section)}: {text}" for section, text in payload) + "}"
+        atomic_write(self.path(guild_id), document)
+
+
+def atomic_write(filename, text):
+    """Write text (or bytes) to a temp file next to filename, fsync it and rename it into place."""
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    temp_name = f'{filename}.tmp'
+    with open(temp_name, 'wb' if isinstance(text, bytes) else 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_name, filename)
+
+
+def explode_guild_data(data, sections=None):
+    """Split a guild dict into {(table, key): row} for row-level storage."""
+    rows = {}
+    for section, value in data.items():
+        if sections is not None and section not in sections:
+            continue
+        if section in KEYED_SECTIONS and isinstance(value, dict):
+            for key, row in value.items():
+                rows[(section, (key,))] = row
+        elif section == "banks" and isinstance(value, dict):
+            for bank, bank_data in value.items():
+                rows[("banks", (bank,))] = {k: v for k, v in bank_data.items() if k != "accounts"}
+                for user_id, account in bank_data.get("accounts", {}).items():
+                    rows[("bank_accounts", (bank, user_id))] = account
+        elif section == "markets" and isinstance(value, dict):
+            for market, market_data in value.items():
+                rows[("markets", (market,))] = {k: v for k, v in market_data.items() if k != "listings"}
+                for listing_key, listing in _listing_keys(market_data.get("listings", {})):
+                    rows[("listings", (market, listing_key))] = listing
+        else:
+            rows[("sections", (section,))] = value
+    return rows
+
+
+def row_section(table, key):
+    """Name of the top-level guild section a stored row belongs to."""
+    if table == "sections":
+        return key[0]
+    if table == "bank_accounts":
+        return "banks"
+    if table == "listings":
+        return "markets"
+    return table
+
+
+def _listing_keys(listings):
+    if isinstance(listings, dict):
+        return listings.items()
+    return _legacy_listing_keys(listings)
+
+
+def _legacy_listing_keys(listings):
+    # Listings saved as a list had IDs that could repeat, so repeated IDs get a suffix
+    seen = {}
+    for listing in listings:
+        key = str(listing.get("id"))
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        yield (key if count == 0 else f"{key}#{count}"), listing
+
+
+def _listing_order(key):
+    listing_id, _, dup = key.partition('#')
+    try:
+        return (int(listing_id), int(dup or 0))
+    except ValueError:
+        return (float('inf'), 0)
+
+
+def assemble_guild_data(rows):
+    """Inverse of explode_guild_data."""
+    data = new_guild_data()
+    accounts = {}
+    listings = {}
+    for (table, key), row in rows.items():
+        if table == "sections":
+            data[key[0]] = row
+        elif table in KEYED_SECTIONS:
+            data.setdefault(table, {})[key[0]] = row
+        elif table == "banks":
+            data["banks"][key[0]] = row
+        elif table == "bank_accounts":
+            accounts.setdefault(key[0], {})[key[1]] = row
+        elif table == "markets":
+            data["markets"][key[0]] = row
+        elif table == "listings":
+            listings.setdefault(key[0], []).append((key[1], row))
+    for bank, bank_accounts in accounts.items():
+        data["banks"].setdefault(bank, {})["accounts"] = bank_accounts
+    for bank_data in data["banks"].values():
+        bank_data.setdefault("accounts", {})
+    for market, market_listings in listings.items():
+        market_listings.sort(key=lambda item: _listing_order(item[0]))
+        data["markets"].setdefault(market, {})["listings"] = dict(market_listings)
+    for market_data in data["markets"].values():
+        market_data.setdefault("listings", {})
+    return data
+
+
+class SQLiteStorage(StorageBackend):
+    """Row-per-entry storage in a single SQLite database running in WAL mode.
+
+    The last written JSON of every row is cached so a save only upserts the rows
+    that changed and deletes the rows that disappeared.
+    """
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.written = {}
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            for table, columns in TABLES.items():
+                key_columns = ", ".join(f"{column} TEXT NOT NULL" for column in columns)
+                primary_key = ", ".join(("guild_id",) + columns)
+                self.conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (guild_id TEXT NOT NULL, {key_columns}, "
+                    f"data TEXT NOT NULL, PRIMARY KEY ({primary_key}))"
+                )
+            self.conn.commit()
+
+    def load_guild(self, guild_id):
+        guild_id = str(guild_id)
+        rows = {}
+        with self.lock:
+            for table, columns in TABLES.items():
+                cursor = self.conn.execute(
+                    f"SELECT {', '.join(columns)}, data FROM {table} WHERE guild_id = ?", (guild_id,)
+                )
+                for record in cursor:
+                    rows[(table, tuple(record[:-1]))] = record[-1]
+        if not rows:
+            return None
+        self.written[guild_id] = dict(rows)
+        return assemble_guild_data({key: json.loads(text) for key, text in rows.items()})
+
+    def dump_guild(self, guild_id, data, sections=None):
+        guild_id = str(guild_id)
+        previous = self.written.get(guild_id)
+        if previous is None:
+            # Nothing known about the stored rows, replace the whole guild
+            current = {key: json.dumps(row) for key, row in explode_guild_data(data).items()}
+            self.written[guild_id] = current
+            return list(current.items()), None
+        current = {key: json.dumps(row) for key, row in explode_guild_data(data, sections).items()}
+        upserts = [(key, text) for key, text in current.items() if previous.get(key) != text]
+        deletes = [
+            key for key in previous
+            if key not in current and (sections is None or row_section(*key) in sections)
+        ]
+        for key, text in upserts:
+            previous[key] = text
+        for key in deletes:
+            del previous[key]
+        return upserts, deletes
+
+    def write_guild(self, guild_id, payload):
+        guild_id = str(guild_id)
+        upserts, deletes = payload
+        if not upserts and deletes == []:
+            return
+        try:
+            with self.lock, self.conn:
+                if deletes is None:
+                    for table in TABLES:
+                        self.conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+                    deletes = []
+                for (table, key), text in upserts:
+                    columns = TABLES[table]
+                    placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+                    self.conn.execute(
+                        f"INSERT INTO {table} (guild_id, {', '.join(columns)}, data) VALUES ({placeholders}) "
+                        f"ON CONFLICT ({', '.join(('guild_id',) + columns)}) DO UPDATE SET data = excluded.data",
+                        (guild_id, *key, text)
+                    )
+                for table, key in deletes:
+                    conditions = " AND ".join(f"{column} = ?" for column in TABLES[table])
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE guild_id = ? AND {conditions}", (guild_id, *key)
+                    )
+        except sqlite3.Error:
+            # The row cache no longer matches the database, force a full rewrite next time
+            self.written.pop(guild_id, None)
+            raise
+
+    def forget(self, guild_id):
+        self.written.pop(str(guild_id), None)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteStorage()
+    if backend == 'binary':
+        from .snapshot import BinarySnapshotStorage
+        return BinarySnapshotStorage()
+    if backend == 'json':
+        return JSONStorage()
+    raise ValueError(f"Unknown economy storage backend: {backend}")
@@ -18,6 +18,7 @@ class TaxSystem:
         if "config" not in guild_data:
             guild_data["config"] = {}
         guild_data["config"]["tax_rate"] = rate
+        self.economy.mark_dirty(ctx.guild.id, "config")
         await ctx.send(f"Tax rate set to {rate}.")
 
     @tax.command(name="info")
@@ -31,8 +32,8 @@ class TaxSystem:
             guild_data = self.economy.get_guild_data(guild.id)
             tax_rate = guild_data.get("config", {}).get("tax_rate", 0)
             if tax_rate > 0:
-                for user_id, wallet in guild_data["wallets"].items():
-                    for currency, amount in wallet.items():
-                        tax = amount * tax_rate
-                        wallet[currency] -= tax
-                        guild_data["currencies"][currency]["in_circulation"] -= tax
+                collected = self.economy.balances.collect_tax(guild.id, tax_rate)
+                for currency, tax in collected.items():
+                    if currency in guild_data["currencies"]:
+                        self.economy.credit(guild.id, ["currencies", currency, "in_circulation"], -tax)
+                    self.economy.aggregates.adjust(guild.id, "supply", currency, -tax)
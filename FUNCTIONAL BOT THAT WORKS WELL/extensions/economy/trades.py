@@ -0,0 +1,83 @@
+import os
+
+# Most recent trades kept per market, item and currency; the rolling VWAP covers these
+TRADE_HISTORY = int(os.getenv('ECONOMY_TRADE_HISTORY', '100'))
+# Candle periods as (name, seconds, candles kept)
+CANDLE_PERIODS = (("1h", 3600, 48), ("1d", 86400, 30))
+
+
+def new_ring():
+    return {"entries": [], "next": 0}
+
+
+def ring_push(ring, value, size):
+    """Add value to a fixed-size ring; returns the entry it replaced, if any."""
+    entries = ring["entries"]
+    index = ring["next"]
+    replaced = None
+    if len(entries) < size:
+        entries.append(value)
+        index = len(entries) - 1
+    else:
+        replaced = entries[index]
+        entries[index] = value
+    ring["next"] = (index + 1) % size
+    return replaced
+
+
+def ring_latest(ring):
+    entries = ring["entries"]
+    return entries[ring["next"] - 1] if entries else None
+
+
+def new_trade_stats():
+    return {
+        # [timestamp, price, amount]
+        "trades": new_ring(),
+        "window_volume": 0,
+        "window_turnover": 0,
+        "volume": 0,
+        "turnover": 0,
+        # [bucket start, open, high, low, close, volume, turnover]
+        "candles": {name: new_ring() for name, _, _ in CANDLE_PERIODS}
+    }
+
+
+def record_trade(stats, timestamp, price, amount):
+    """Fold one executed trade into a market item's stats; every update is O(1)."""
+    value = price * amount
+    replaced = ring_push(stats["trades"], [timestamp, price, amount], TRADE_HISTORY)
+    stats["window_volume"] += amount
+    stats["window_turnover"] += value
+    if replaced is not None:
+        stats["window_volume"] -= replaced[2]
+        stats["window_turnover"] -= replaced[1] * replaced[2]
+    stats["volume"] += amount
+    stats["turnover"] += value
+    for name, seconds, keep in CANDLE_PERIODS:
+        ring = stats["candles"].setdefault(name, new_ring())
+        start = int(timestamp // seconds * seconds)
+        candle = ring_latest(ring)
+        if candle is not None and candle[0] == start:
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+            candle[5] += amount
+            candle[6] += value
+        else:
+            ring_push(ring, [start, price, price, price, price, amount, value], keep)
+
+
+def trade_summary(stats, now):
+    """Last price, rolling VWAP and the candles of the current hour and day (None when empty)."""
+    last = ring_latest(stats["trades"])
+    summary = {
+        "last": last[1] if last else None,
+        "vwap": stats["window_turnover"] / stats["window_volume"] if stats["window_volume"] else None,
+        "volume": stats["volume"]
+    }
+    for name, seconds, _ in CANDLE_PERIODS:
+        candle = ring_latest(stats["candles"].get(name, new_ring()))
+        current = candle is not None and candle[0] == int(now // seconds * seconds)
+        summary[name] = candle if current else None
+    return summary
@@ -9,19 +9,17 @@ class WalletSystem:
     @commands.command(name="balance")
     async def balance(self, ctx, currency: str = None):
         guild_data = self.economy.get_guild_data(ctx.guild.id)
-        user_id = str(ctx.author.id)
-        if user_id not in guild_data["wallets"]:
-            guild_data["wallets"][user_id] = {cur: 0 for cur in guild_data["currencies"]}
+        balances = self.economy.balances
         
         if currency:
             if currency not in guild_data["currencies"]:
                 await ctx.send(f"Currency {currency} does not exist.")
                 return
-            balance = guild_data["wallets"][user_id][currency]
+            balance = balances.get(ctx.guild.id, ctx.author.id, currency)
             await ctx.send(f"Your balance for {currency}: {balance} {guild_data['currencies'][currency]['symbol']}")
         else:
             embed = discord.Embed(title=f"Wallet Balance for {ctx.author.name}", color=discord.Color.green())
-            for cur, amount in guild_data["wallets"][user_id].items():
+            for cur, amount in balances.wallet(ctx.guild.id, ctx.author.id).items():
                 embed.add_field(name=cur, value=f"{amount} {guild_data['currencies'][cur]['symbol']}")
             await ctx.send(embed=embed)
 
@@ -32,16 +30,11 @@ class WalletSystem:
             await ctx.send(f"Currency {currency} does not exist.")
             return
         
-        sender_id, recipient_id = str(ctx.author.id), str(recipient.id)
-        if sender_id not in guild_data["wallets"]:
-            guild_data["wallets"][sender_id] = {cur: 0 for cur in guild_data["currencies"]}
-        if recipient_id not in guild_data["wallets"]:
-            guild_data["wallets"][recipient_id] = {cur: 0 for cur in guild_data["currencies"]}
-        
-        if guild_data["wallets"][sender_id][currency] < amount:
+        balances = self.economy.balances
+        if balances.get(ctx.guild.id, ctx.author.id, currency) < amount:
             await ctx.send("Insufficient funds.")
             return
         
-        guild_data["wallets"][sender_id][currency] -= amount
-        guild_data["wallets"][recipient_id][currency] += amount
+        balances.add(ctx.guild.id, ctx.author.id, currency, -amount)
+        balances.add(ctx.guild.id, recipient.id, currency, amount)
         await ctx.send(f"Transferred {amount} {guild_data['currencies'][currency]['symbol']} to {recipient.name}")
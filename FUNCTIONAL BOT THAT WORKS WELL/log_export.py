@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import zlib
+
+EXPORT_FORMATS = ('text', 'jsonl')
+# Bytes of uncompressed input between sync flushes, bounds what the compressor holds back
+COMPRESS_FLUSH_BYTES = 256 * 1024
+# Room left under the size limit for the gzip trailer and a final deflate block
+GZIP_SLACK = 1024
+
+
+def export_extension(format, compress):
+    return ('.jsonl' if format == 'jsonl' else '.txt') + ('.gz' if compress else '')
+
+
+def format_entry(format, created_at, channel_name, thread_name, author_name, content, message_id, channel_label=True):
+    if format == 'jsonl':
+        return json.dumps({
+            "timestamp": created_at.isoformat(),
+            "channel": channel_name,
+            "thread": thread_name,
+            "alias": author_name,
+            "content": content,
+            "message_id": message_id
+        }, ensure_ascii=False) + '\n'
+    if not channel_label:
+        return f'{author_name}: {content}\n'
+    if thread_name:
+        return f'[{channel_name} > {thread_name}] {author_name}: {content}\n'
+    return f'[{channel_name}] {author_name}: {content}\n'
+
+
+class LogExportWriter:
+    """Streams log lines into chunk files that each stay under max_bytes.
+
+    Chunks after the first are named <name>_part2<ext>, <name>_part3<ext>, ...
+    With compress set every chunk is its own gzip file, compressed incrementally
+    as lines arrive. Appending to an existing chunk adds a new gzip member, which
+    gzip readers treat as one stream. Without channel_label, text lines leave out
+    the [channel] prefix, for logs of a single channel.
+    """
+
+    def __init__(self, path, format='text', compress=False, max_bytes=None, append=False, channel_label=True):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {format}")
+        self.format = format
+        self.channel_label = channel_label
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.file = None
+        self.compressor = None
+        self.written = 0
+        self.pending = 0
+        self.lines = 0
+        # Small limits need more frequent flushes, or the held-back input alone would fill a chunk
+        self.flush_bytes = min(COMPRESS_FLUSH_BYTES, max_bytes // 8) if max_bytes else COMPRESS_FLUSH_BYTES
+        match = re.match(r'(.*?)(?:_part(\d+))?(\.[^/\\]*)$', os.path.basename(path))
+        self.directory = os.path.dirname(path)
+        self.stem, self.extension = match.group(1), match.group(3)
+        self.part = int(match.group(2) or 1)
+        self.open_chunk(append and os.path.exists(path))
+
+    def chunk_path(self, part):
+        suffix = f'_part{part}' if part > 1 else ''
+        return os.path.join(self.directory, f'{self.stem}{suffix}{self.extension}')
+
+    def open_chunk(self, append=False):
+        path = self.chunk_path(self.part)
+        self.file = open(path, 'ab' if append else 'wb')
+        self.written = self.file.tell()
+        self.pending = 0
+        if self.compress:
+            # wbits=31 produces the gzip container
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.paths.append(path)
+
+    def close_chunk(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush(zlib.Z_FINISH))
+            self.compressor = None
+        self.file.close()
+        self.file = None
+
+    def write(self, created_at, channel_name, thread_name, author_name, content, message_id=None):
+        data = format_entry(self.format, created_at, channel_name, thread_name, author_name, content, message_id,
+                            self.channel_label).encode('utf-8')
+        if self.max_bytes and self.written + self.pending > 0 and self.projected_size(len(data)) > self.max_bytes:
+            self.close_chunk()
+            self.part += 1
+            self.open_chunk()
+        if self.compressor is not None:
+            out = self.compressor.compress(data)
+            self.pending += len(data)
+            if self.pending >= self.flush_bytes:
+                out += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                self.pending = 0
+        else:
+            out = data
+        self.file.write(out)
+        self.written += len(out)
+        self.lines += 1
+
+    def projected_size(self, size):
+        # Worst-case chunk size once size more bytes are written and the chunk is finished
+        if self.compressor is None:
+            return self.written + size
+        return self.written + self.pending + size + GZIP_SLACK
+
+    def close(self):
+        """Finish the last chunk and return the paths of every chunk written."""
+        if self.file is not None:
+            self.close_chunk()
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
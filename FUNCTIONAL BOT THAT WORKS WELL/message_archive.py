@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class MessageArchive:
+    """Local SQLite copy of tagged channel history, keyed by channel and message snowflake.
+
+    synced_through records, per channel, the highest message ID up to which the
+    archive holds every message, so logs only need the API for the gap after it.
+    Message text is also kept in an FTS5 index (rowid = message ID) for search.
+    The connection is shared with worker threads; writes hold a lock so their
+    transactions do not interleave.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "channel_id INTEGER NOT NULL, message_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, "
+            "author_id INTEGER NOT NULL, author_name TEXT NOT NULL, created_at TEXT NOT NULL, "
+            "content TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, parent_id INTEGER, "
+            "PRIMARY KEY (channel_id, message_id)) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(messages)")]
+        if "parent_id" not in columns:
+            # Archives created before search support; thread rows get no parent until refetched
+            self.conn.execute("ALTER TABLE messages ADD COLUMN parent_id INTEGER")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state (channel_id INTEGER PRIMARY KEY, synced_through INTEGER NOT NULL)"
+        )
+        has_index = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'message_search'"
+        ).fetchone()
+        # root_id is the channel a message belongs to, or a thread's parent channel
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+            "content, author_name UNINDEXED, author_id UNINDEXED, root_id UNINDEXED, "
+            "channel_id UNINDEXED, guild_id UNINDEXED)"
+        )
+        if not has_index:
+            self.conn.execute(
+                "INSERT INTO message_search (rowid, content, author_name, author_id, root_id, channel_id, guild_id) "
+                "SELECT message_id, content, author_name, author_id, COALESCE(parent_id, channel_id), channel_id, guild_id "
+                "FROM messages WHERE deleted = 0"
+            )
+        self.conn.commit()
+
+    def store(self, messages, parent_id=None):
+        # parent_id stands in for threads fetched without a full Thread object
+        rows = [
+            (msg.channel.id, msg.id, msg.guild.id, msg.author.id, msg.author.name,
+             msg.created_at.isoformat(), msg.content, parent_id or getattr(msg.channel, 'parent_id', None))
+            for msg in messages
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO messages (channel_id, message_id, guild_id, author_id, author_name, created_at, content, parent_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (channel_id, message_id) DO UPDATE SET "
+                "content = excluded.content, author_name = excluded.author_name, parent_id = excluded.parent_id",
+                rows
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO message_search (rowid, content, author_name, author_id, root_id, channel_id, guild_id) "
+                "SELECT message_id, content, author_name, author_id, COALESCE(parent_id, channel_id), channel_id, guild_id "
+                "FROM messages WHERE channel_id = ? AND message_id = ? AND deleted = 0",
+                [(row[0], row[1]) for row in rows]
+            )
+
+    def edit(self, channel_id, message_id, content):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE messages SET content = ? WHERE channel_id = ? AND message_id = ?",
+                (content, channel_id, message_id)
+            )
+            self.conn.execute("UPDATE message_search SET content = ? WHERE rowid = ?", (content, message_id))
+
+    def delete(self, channel_id, message_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE messages SET deleted = 1 WHERE channel_id = ? AND message_id = ?",
+                (channel_id, message_id)
+            )
+            self.conn.execute("DELETE FROM message_search WHERE rowid = ?", (message_id,))
+
+    def search(self, guild_id, root_ids, query, author_ids=(), author_name=None, limit=10):
+        """Best-ranked messages matching every word of query, as (message_id, channel_id, author_id, author_name, content).
+
+        root_ids limits hits to those channels and their threads; author_ids and
+        author_name, when given, limit hits to matching authors.
+        """
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if not terms or not root_ids:
+            return []
+        conditions = [f"root_id IN ({', '.join('?' for _ in root_ids)})"]
+        params = [" ".join(terms), guild_id, *root_ids]
+        if author_ids or author_name:
+            authors = []
+            if author_ids:
+                authors.append(f"author_id IN ({', '.join('?' for _ in author_ids)})")
+                params.extend(author_ids)
+            if author_name:
+                authors.append("author_name = ? COLLATE NOCASE")
+                params.append(author_name)
+            conditions.append(f"({' OR '.join(authors)})")
+        params.append(limit)
+        return self.conn.execute(
+            "SELECT rowid, channel_id, author_id, author_name, content FROM message_search "
+            f"WHERE message_search MATCH ? AND guild_id = ? AND {' AND '.join(conditions)} "
+            "ORDER BY rank LIMIT ?",
+            params
+        ).fetchall()
+
+    def synced_through(self, channel_id):
+        row = self.conn.execute(
+            "SELECT synced_through FROM sync_state WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def set_synced_through(self, channel_id, message_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (channel_id, synced_through) VALUES (?, ?) "
+                "ON CONFLICT (channel_id) DO UPDATE SET synced_through = MAX(synced_through, excluded.synced_through)",
+                (channel_id, message_id)
+            )
+
+    def latest_id(self, channel_id):
+        row = self.conn.execute(
+            "SELECT MAX(message_id) FROM messages WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row[0] or 0
+
+    def page(self, channel_id, after_id, limit=100):
+        """Next messages after after_id, oldest first: (id, author_id, author_name, created_at, content)."""
+        rows = self.conn.execute(
+            "SELECT message_id, author_id, author_name, created_at, content FROM messages "
+            "WHERE channel_id = ? AND message_id > ? AND deleted = 0 ORDER BY message_id LIMIT ?",
+            (channel_id, after_id or 0, limit)
+        ).fetchall()
+        return [
+            (message_id, author_id, author_name, datetime.fromisoformat(created_at), content)
+            for message_id, author_id, author_name, created_at, content in rows
+        ]
+
+    def close(self):
+        self.conn.close()
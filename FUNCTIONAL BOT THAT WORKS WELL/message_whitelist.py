@@ -0,0 +1,130 @@
+import re
+
+# Whitelist entries starting with these markers are not plain substrings
+ANCHORED_PREFIX = '^'
+REGEX_PREFIX = 're:'
+# Makes the rest of an entry a plain substring even if it starts with a marker
+LITERAL_PREFIX = '\\'
+# Separates entries in !set_whitelist; written as \, inside an entry
+SEPARATOR = ','
+# Stored whitelists older than this predate the markers and are migrated on load
+WHITELIST_VERSION = 2
+
+
+def format_pattern(format):
+    """Regex source for one literal or anchored whitelist entry.
+
+    "^text" only matches at the start of a message, "\\text" matches text
+    literally, anything else matches anywhere in the message. "re:" entries are
+    compiled on their own by compile_whitelist.
+    """
+    if format.startswith(LITERAL_PREFIX):
+        return re.escape(format[len(LITERAL_PREFIX):])
+    if format.startswith(ANCHORED_PREFIX) and len(format) > len(ANCHORED_PREFIX):
+        return r'\A' + re.escape(format[len(ANCHORED_PREFIX):])
+    return re.escape(format)
+
+
+def split_formats(text):
+    """Split !set_whitelist input on commas that are not escaped as \\,"""
+    formats = ['']
+    position = 0
+    while position < len(text):
+        if text.startswith(LITERAL_PREFIX + SEPARATOR, position):
+            formats[-1] += SEPARATOR
+            position += len(LITERAL_PREFIX + SEPARATOR)
+        elif text.startswith(SEPARATOR, position):
+            formats.append('')
+            position += len(SEPARATOR)
+        else:
+            formats[-1] += text[position]
+            position += 1
+    return [format.strip() for format in formats]
+
+
+def escape_format(format):
+    """Entry matching format as a plain substring, the way every entry matched before markers existed."""
+    if format.startswith((ANCHORED_PREFIX, REGEX_PREFIX, LITERAL_PREFIX)):
+        return LITERAL_PREFIX + format
+    return format
+
+
+def migrate_whitelist(guild_data):
+    """Escape a stored whitelist saved before the markers, so its entries keep their meaning."""
+    if guild_data.get("whitelist_version", 1) < WHITELIST_VERSION:
+        guild_data["message_whitelist"] = [escape_format(format) for format in guild_data.get("message_whitelist", [])]
+        guild_data["whitelist_version"] = WHITELIST_VERSION
+    return guild_data
+
+
+class WhitelistMatcher:
+    """Literal and anchored entries combined into one pattern, plus each regex entry on its own.
+
+    The regex engine checks every literal alternative in a single pass over the
+    message, instead of one substring scan per format. Regex entries keep their
+    own pattern, so inline flags and group numbers mean what they did when written.
+    """
+
+    def __init__(self, combined, regexes):
+        self.combined = combined
+        self.regexes = regexes
+
+    def search(self, content):
+        """The first match in content, or None when no entry allows it."""
+        match = self.combined.search(content) if self.combined else None
+        for pattern in self.regexes:
+            if match is not None:
+                break
+            match = pattern.search(content)
+        return match
+
+
+def compile_regex(format):
+    source = format[len(REGEX_PREFIX):]
+    try:
+        return re.compile(source)
+    except re.error as e:
+        raise ValueError(f'Invalid regex format "{source}": {e}')
+
+
+def compile_whitelist(formats):
+    """Compile a whitelist into an object with search(), or None when it allows everything.
+
+    Raises ValueError for a regex entry that does not compile.
+    """
+    formats = [format for format in formats if format]
+    if not formats:
+        return None
+    literals = [format_pattern(format) for format in formats if not format.startswith(REGEX_PREFIX)]
+    regexes = [compile_regex(format) for format in formats if format.startswith(REGEX_PREFIX)]
+    combined = re.compile('|'.join(literals)) if literals else None
+    # Without regex entries the combined pattern is searched directly, skipping a call per message
+    return WhitelistMatcher(combined, regexes) if regexes else combined
+
+
+def benchmark(format_count=40, message_count=100000, repeat=3):
+    import random
+    import string
+    import timeit
+
+    rng = random.Random(0)
+    formats = [f"[{''.join(rng.choices(string.ascii_uppercase, k=rng.randint(2, 6)))}]" for _ in range(format_count)]
+    words = ["the", "quick", "brown", "fox", "walks", "into", "a", "dim", "tavern", "and", "says"]
+    messages = []
+    for i in range(message_count):
+        text = " ".join(rng.choices(words, k=rng.randint(5, 40)))
+        messages.append(f'{rng.choice(formats)} {text}' if i % 3 == 0 else text)
+
+    matcher = compile_whitelist(formats)
+    linear = lambda: sum(any(format in content for format in formats) for content in messages)
+    compiled = lambda: sum(matcher.search(content) is not None for content in messages)
+    assert linear() == compiled()
+    linear_time = min(timeit.repeat(linear, number=1, repeat=repeat))
+    compiled_time = min(timeit.repeat(compiled, number=1, repeat=repeat))
+    print(f'{format_count} formats, {message_count} messages')
+    print(f'linear any():     {linear_time:.3f}s')
+    print(f'compiled matcher: {compiled_time:.3f}s ({linear_time / compiled_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    benchmark()
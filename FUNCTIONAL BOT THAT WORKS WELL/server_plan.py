@@ -0,0 +1,293 @@
+import hashlib
+import discord
+
+
+class ConfigError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors if isinstance(errors, list) else [errors]
+        super().__init__("; ".join(self.errors))
+
+
+class DesiredCategory:
+    def __init__(self, name, position):
+        self.name = name
+        self.position = position
+        self.channels = []
+
+
+class DesiredChannel:
+    def __init__(self, name, topic, position):
+        self.name = name
+        self.topic = topic
+        self.position = position
+
+
+class DesiredRole:
+    def __init__(self, name, color, permissions):
+        self.name = name
+        self.color = color
+        self.permissions = permissions
+
+
+class ServerConfig:
+    """Desired server state: categories with their text channels, and roles in hierarchy order."""
+
+    def __init__(self):
+        self.categories = []
+        self.roles = []
+
+
+def detect_format(lines):
+    """Which of the three template formats a file uses.
+
+    'config' is server_config.txt (CATEGORY:/CHANNEL:/ROLE:), 'brackets' is the
+    {category}/[channel|topic] input.txt of Server_C&C_Creator.py and 'roles' is
+    roles.txt of Role_Create_From_File.py (name,color,permissions...).
+    """
+    stripped = [line.strip() for line in lines if line.strip()]
+    if any(line.startswith(('CATEGORY:', 'CHANNEL:', 'ROLE:')) for line in stripped):
+        return 'config'
+    if any(line.startswith('{') and line.endswith('}') for line in stripped):
+        return 'brackets'
+    return 'roles'
+
+
+def parse_role(role_info, line_number, errors):
+    # role_info is [name, hex color, permission...]; problems are added to errors
+    role_name = role_info[0].strip()
+    if not role_name:
+        errors.append(f"Line {line_number}: role without a name")
+    color = discord.Colour.default()
+    if len(role_info) > 1 and role_info[1].strip():
+        try:
+            color = discord.Colour(int(role_info[1].strip(), 16))
+        except ValueError:
+            errors.append(f"Line {line_number}: invalid color for role {role_name}: {role_info[1].strip()}")
+    permissions = discord.Permissions()
+    for perm in role_info[2:]:
+        perm = perm.strip()
+        if perm in discord.Permissions.VALID_FLAGS:
+            setattr(permissions, perm, True)
+        elif perm:
+            errors.append(f"Line {line_number}: invalid permission for role {role_name}: {perm}")
+    return DesiredRole(role_name, color, permissions)
+
+
+def parse_template(lines, format=None):
+    """Parse a template in any of the three formats into a ServerConfig.
+
+    Every problem in the file is collected and raised together as one ConfigError.
+    """
+    lines = list(lines)
+    format = format or detect_format(lines)
+    config = ServerConfig()
+    errors = []
+    for index, line in enumerate(lines):
+        line = line.strip()
+        line_number = index + 1
+        if not line:
+            continue
+        if format == 'roles':
+            config.roles.append(parse_role(line.split(','), line_number, errors))
+            continue
+        if format == 'config':
+            if line.startswith('CATEGORY:'):
+                category_name = line[9:].strip()
+            elif line.startswith('CHANNEL:'):
+                channel_line = line[8:].strip()
+            elif line.startswith('ROLE:'):
+                config.roles.append(parse_role(line[5:].strip().split(','), line_number, errors))
+                continue
+            else:
+                continue
+            is_category = line.startswith('CATEGORY:')
+        else:
+            if line.startswith('{') and line.endswith('}'):
+                category_name = line[1:-1].strip()
+            elif line.startswith('[') and line.endswith(']'):
+                channel_line = line[1:-1]
+            else:
+                continue
+            is_category = line.startswith('{')
+        if is_category:
+            if not category_name:
+                errors.append(f"Line {line_number}: category without a name")
+            config.categories.append(DesiredCategory(category_name, index))
+            continue
+        if not config.categories:
+            errors.append(f"Line {line_number}: channel specified without a category")
+            continue
+        channel_info = channel_line.split('|')
+        channel_name = channel_info[0].strip()
+        channel_topic = channel_info[1].strip() if len(channel_info) > 1 else ""
+        if not channel_name:
+            errors.append(f"Line {line_number}: channel without a name")
+        config.categories[-1].channels.append(DesiredChannel(channel_name, channel_topic, index))
+    if errors:
+        raise ConfigError(errors)
+    return config
+
+
+def parse_server_config(lines):
+    """Parse server_config.txt (CATEGORY:, CHANNEL: name | topic, ROLE: name, hex color, permissions...)."""
+    return parse_template(lines, 'config')
+
+
+# Compiled templates keyed by the SHA-256 of the file contents
+template_cache = {}
+
+
+def compile_template(path):
+    """Parse and validate a template file, reusing the result while the file is unchanged."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if digest not in template_cache:
+        template_cache[digest] = parse_template(content.decode('utf-8').splitlines())
+    return template_cache[digest]
+
+
+def channel_key(name):
+    # Discord lowercases text channel names and turns spaces into dashes
+    return name.strip().lower().replace(' ', '-')
+
+
+class PlannedChange:
+    def __init__(self, key, action, kind, name, route, apply, depends_on=(), details=''):
+        self.key = key
+        self.action = action
+        self.kind = kind
+        self.name = name
+        self.route = route
+        self.apply = apply
+        self.depends_on = depends_on
+        self.details = details
+
+    def describe(self):
+        return f'{self.action} {self.kind} {self.name}' + (f' ({self.details})' if self.details else '')
+
+
+class ServerPlan:
+    """The create, edit and delete calls that turn a guild into a ServerConfig."""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def add_to(self, executor):
+        for change in self.changes:
+            executor.add(change.key, change.route, change.describe(), change.apply, change.depends_on)
+
+    def summary(self):
+        counts = {}
+        for change in self.changes:
+            counts[change.action] = counts.get(change.action, 0) + 1
+        if not counts:
+            return 'The server already matches the configuration.'
+        return ', '.join(f'{count} to {action}' for action, count in counts.items())
+
+
+def plan_server(config, guild, prune=False):
+    """Diff config against the guild's cached state.
+
+    Categories and roles are matched by name, channels by name within their
+    category. Existing channels are moved, retitled and recolored in place.
+    Anything the config does not mention is only deleted when prune is set, and
+    only for the kinds the config describes, so a roles-only template never
+    deletes channels.
+    """
+    changes = []
+    categories = {category.name: category for category in guild.categories}
+    channels = {}
+    for channel in guild.text_channels:
+        channels.setdefault(channel_key(channel.name), []).append(channel)
+    kept_channels = set()
+
+    for desired in config.categories:
+        category = categories.pop(desired.name, None)
+        if category is None:
+            category_ref = f'category:{desired.position}'
+            changes.append(PlannedChange(
+                category_ref, 'create', 'category', desired.name, 'create_channel',
+                lambda results, desired=desired: guild.create_category(desired.name, position=desired.position)
+            ))
+        else:
+            category_ref = None
+
+        for desired_channel in desired.channels:
+            key = f'channel:{desired_channel.position}'
+            candidates = channels.get(channel_key(desired_channel.name), [])
+            # Prefer a channel already in the right category, then one that is not claimed yet
+            channel = next((c for c in candidates if category is not None and c.category_id == category.id and c.id not in kept_channels), None)
+            channel = channel or next((c for c in candidates if c.id not in kept_channels), None)
+            if channel is None:
+                changes.append(PlannedChange(
+                    key, 'create', 'channel', desired_channel.name, 'create_channel',
+                    lambda results, desired=desired_channel, category=category, ref=category_ref: guild.create_text_channel(
+                        desired.name, category=category or results[ref], topic=desired.topic, position=desired.position),
+                    depends_on=(category_ref,) if category_ref else ()
+                ))
+                continue
+            kept_channels.add(channel.id)
+            edits = {}
+            details = []
+            if (channel.topic or '') != desired_channel.topic:
+                edits['topic'] = desired_channel.topic
+                details.append('topic')
+            if category is None or channel.category_id != category.id:
+                details.append(f'move to {desired.name}')
+            if edits or category is None or channel.category_id != category.id:
+                changes.append(PlannedChange(
+                    key, 'edit', 'channel', channel.name, 'edit_channel',
+                    lambda results, channel=channel, edits=edits, category=category, ref=category_ref: channel.edit(
+                        category=category or results[ref], **edits),
+                    depends_on=(category_ref,) if category_ref else (),
+                    details=', '.join(details)
+                ))
+
+    roles = {role.name: role for role in guild.roles if not role.is_default() and not role.managed}
+    previous_role = None
+    for index, desired in enumerate(config.roles):
+        role = roles.pop(desired.name, None)
+        key = f'role:{index}'
+        if role is None:
+            # New roles land at the bottom, so they are created one after another to keep the file's order
+            changes.append(PlannedChange(
+                key, 'create', 'role', desired.name, 'create_role',
+                lambda results, desired=desired: guild.create_role(
+                    name=desired.name, color=desired.color, permissions=desired.permissions),
+                depends_on=(previous_role,) if previous_role else ()
+            ))
+            previous_role = key
+            continue
+        edits = {}
+        if role.color != desired.color:
+            edits['color'] = desired.color
+        if role.permissions.value != desired.permissions.value:
+            edits['permissions'] = desired.permissions
+        if edits:
+            changes.append(PlannedChange(
+                key, 'edit', 'role', desired.name, 'edit_role',
+                lambda results, role=role, edits=edits: role.edit(**edits),
+                details=', '.join(edits)
+            ))
+
+    if prune and config.categories:
+        for channel in guild.text_channels:
+            if channel.id not in kept_channels:
+                changes.append(PlannedChange(
+                    f'delete:{channel.id}', 'delete', 'channel', channel.name, 'delete_channel',
+                    lambda results, channel=channel: channel.delete()
+                ))
+        for category in categories.values():
+            changes.append(PlannedChange(
+                f'delete:{category.id}', 'delete', 'category', category.name, 'delete_channel',
+                lambda results, category=category: category.delete()
+            ))
+    if prune and config.roles:
+        for role in roles.values():
+            if role < guild.me.top_role:
+                changes.append(PlannedChange(
+                    f'delete:{role.id}', 'delete', 'role', role.name, 'delete_role',
+                    lambda results, role=role: role.delete()
+                ))
+    return ServerPlan(changes)
@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("numpy")
+
+from extensions.economy.balances import ColumnarWallets
+
+
+def test_round_trip_stores_only_held_currencies():
+    # The matrix holds floats, so the saved wallets compare equal to float input
+    wallets = {str(user_id): {f"currency{user_id}": user_id * 10.0} for user_id in range(50)}
+    store = ColumnarWallets.from_dict(wallets)
+    store["7"]["gold"] = 5.0
+    wallets["7"]["gold"] = 5.0
+
+    assert store.to_dict() == wallets
+    assert len(json.dumps(store.to_dict())) == len(json.dumps(wallets))
+
+
+def test_deleted_currency_is_dropped_from_the_wallet():
+    store = ColumnarWallets.from_dict({"1": {"gold": 3, "silver": 4}})
+    del store["1"]["gold"]
+
+    assert dict(store["1"]) == {"silver": 4}
+    assert store["1"].get("gold", 0) == 0
+    assert store.to_dict() == {"1": {"silver": 4}}
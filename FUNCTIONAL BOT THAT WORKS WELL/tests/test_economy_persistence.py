@@ -0,0 +1,137 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions.economy import EconomySystem
+from extensions.economy.journal import Journal
+from extensions.economy.storage import JSONStorage, SQLiteStorage
+
+
+class Bot:
+    pass
+
+
+def create_storage(backend, data_dir):
+    if backend == 'sqlite':
+        return SQLiteStorage(os.path.join(data_dir, 'economy.db'))
+    return JSONStorage(data_dir)
+
+
+def economy_in(backend, data_dir):
+    economy = EconomySystem(Bot())
+    economy.storage = create_storage(backend, data_dir)
+    economy.journal = Journal(data_dir)
+    return economy
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_change_during_multi_guild_flush_survives_restart(backend, tmp_path):
+    data_dir = str(tmp_path)
+
+    async def run():
+        economy = economy_in(backend, data_dir)
+        economy.balances.add(1, 10, "gold", 100)
+        economy.balances.add(2, 20, "gold", 100)
+        await economy.save_data()
+        # Guild 2 is flushed for another section, the wallet change arrives mid-flush
+        economy.balances.add(1, 10, "gold", 0)
+        economy.credit(2, ["inventories", "20", "ore"], 1)
+        await economy.journal.commit()
+
+        # Hold guild 1's write open and change guild 2 while it is in flight
+        writing, release = threading.Event(), threading.Event()
+        write_guild = economy.storage.write_guild
+
+        def slow_write_guild(guild_id, payload):
+            if guild_id == "1":
+                writing.set()
+                release.wait(5)
+            write_guild(guild_id, payload)
+
+        economy.storage.write_guild = slow_write_guild
+        flush = asyncio.create_task(economy.save_data())
+        while not writing.is_set():
+            await asyncio.sleep(0.01)
+        economy.balances.add(2, 20, "gold", 55)
+        await economy.journal.commit()
+        release.set()
+        await flush
+        economy.storage.close()
+
+        restarted = economy_in(backend, data_dir)
+        assert restarted.balances.get(2, 20, "gold") == 155
+        assert restarted.get_guild_data(2)["inventories"]["20"]["ore"] == 1
+        assert restarted.balances.get(1, 10, "gold") == 100
+        restarted.storage.close()
+
+    asyncio.run(run())
+
+
+class Guild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class Context:
+    def __init__(self, guild_id, user_id):
+        self.guild = Guild(guild_id)
+        self.author = Guild(user_id)
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+async def invoke(command, system, ctx, *args):
+    # Commands are defined on plain classes, so the callback is called with its system as self
+    await getattr(command, "callback", command)(system, ctx, *args)
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_journal_replay_after_crash_before_snapshot(backend, tmp_path):
+    data_dir = str(tmp_path)
+
+    async def run():
+        economy = economy_in(backend, data_dir)
+        economy.bot.guilds = [Guild(1)]
+        admin, user = Context(1, 1), Context(1, 2)
+        await invoke(type(economy.currency).currency_create, economy.currency, admin, "gold", "g")
+        economy.balances.add(1, 2, "gold", 100)
+        await invoke(type(economy.bank).bank_create, economy.bank, admin, "vault", 2.4)
+        await invoke(type(economy.bank).bank_deposit, economy.bank, user, "vault", 50, "gold")
+        await economy.bank.process_interest()
+        await invoke(type(economy.market).market_create, economy.market, admin, "bazaar")
+        await invoke(type(economy.loan).loan_request, economy.loan, user, 30, "gold")
+        await economy.journal.commit()
+        # Crash: nothing but the journal reached the disk
+        expected = {key: economy.get_guild_data(1)[key] for key in ("currencies", "wallets", "banks", "markets", "loans")}
+        economy.storage.close()
+
+        restarted = economy_in(backend, data_dir)
+        restarted.bot.guilds = [Guild(1)]
+        guild_data = restarted.get_guild_data(1)
+        for key, value in expected.items():
+            assert guild_data[key] == value
+        assert guild_data["banks"]["vault"]["accounts"]["2"]["gold"] == pytest.approx(55)
+        await restarted.bank.process_interest()
+        restarted.storage.close()
+
+    asyncio.run(run())
+
+
+def test_economy_commands_load_the_invoking_guild(tmp_path):
+    async def run():
+        economy_in('json', str(tmp_path))
+        economy = economy_in('json', str(tmp_path))
+        balance = type(economy.wallet).balance
+        # Only the newest instance's check is kept on the shared command
+        assert len(balance.checks) == 1
+        assert await balance.checks[0](Context(1, 2))
+        assert "1" in economy.data
+        economy.storage.close()
+
+    asyncio.run(run())
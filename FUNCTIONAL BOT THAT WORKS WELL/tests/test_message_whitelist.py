@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_whitelist import compile_whitelist, migrate_whitelist, split_formats
+
+
+def allows(formats, content):
+    matcher = compile_whitelist(formats)
+    return matcher is None or matcher.search(content) is not None
+
+
+def test_empty_whitelist_allows_everything():
+    assert compile_whitelist(['', '']) is None
+
+
+def test_literal_formats_match_anywhere():
+    assert allows(['[IC]', '(OOC)'], 'hello (OOC) there')
+    assert not allows(['[IC]', '(OOC)'], 'hello there')
+
+
+def test_anchored_formats_match_only_at_the_start():
+    assert allows(['^[IC]'], '[IC] hello')
+    assert not allows(['^[IC]'], 'hello [IC]')
+
+
+def test_literal_prefix_escapes_markers():
+    assert allows(['\\^hi', '\\re:x'], 'say ^hi')
+    assert allows(['\\re:x'], 'a re:x b')
+    assert not allows(['\\re:x'], 'x')
+
+
+def test_regex_formats_keep_their_own_flags_and_groups():
+    assert allows(['re:(?i)ooc', '[IC]'], 'this is OOC')
+    assert allows(['re:(a)\\1', 're:(b)\\1'], 'bb')
+    assert not allows(['re:(a)\\1', 're:(b)\\1'], 'ab')
+
+
+def test_invalid_regex_is_a_value_error():
+    with pytest.raises(ValueError):
+        compile_whitelist(['re:(unclosed'])
+
+
+def test_escaped_separator_stays_inside_a_format():
+    assert split_formats('re:a{1\\,3}b, [OOC]') == ['re:a{1,3}b', '[OOC]']
+    assert allows(split_formats('re:a{1\\,3}b'), 'aab')
+
+
+def test_old_entries_are_migrated_to_literals():
+    guild_data = migrate_whitelist({"message_whitelist": ['^hi', 're:x', 'plain']})
+    assert allows(guild_data["message_whitelist"], 'say ^hi')
+    assert not allows(guild_data["message_whitelist"], 'x')
@@ -1,4 +1,10 @@
 import discord
+import os
+import sys
+
+# The log export format is shared with the server-manager bot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FUNCTIONAL BOT THAT WORKS WELL'))
+from log_export import EXPORT_FORMATS, LogExportWriter, export_extension
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -17,8 +23,13 @@ async def on_message(message):
     if message.content.startswith('!log'):
         # Check if the command has the required number of arguments
         args = message.content.split()
-        if len(args) != 2:
-            await message.channel.send('Invalid usage. Use !log #, where # is the number of messages to log.')
+        options = [arg for arg in args[2:] if arg == '--gzip' or arg.startswith('--format=')]
+        if len(args) < 2 or len(options) != len(args) - 2:
+            await message.channel.send('Invalid usage. Use !log # [--format=jsonl] [--gzip], where # is the number of messages to log.')
+            return
+        export_format = next((arg.split('=', 1)[1] for arg in options if arg.startswith('--format=')), 'text')
+        if export_format not in EXPORT_FORMATS:
+            await message.channel.send(f'Unknown log format: {export_format}. Use one of: {", ".join(EXPORT_FORMATS)}')
             return
         
         try:
@@ -39,14 +50,21 @@ async def on_message(message):
         # Reverse the messages list to save them in oldest at the top order
         messages.reverse()
 
-        # Open a file to log the messages
-        file_name = f'{message.channel.name}_log.txt'
-        with open(file_name, 'w', encoding='utf-8') as log_file:
+        # Write the log in chunks small enough to upload, then send them to the channel
+        compress = '--gzip' in options
+        max_bytes = message.guild.filesize_limit if message.guild else 10 * 1024 * 1024
+        file_name = f'{message.channel.name}_log{export_extension(export_format, compress)}'
+        with LogExportWriter(file_name, export_format, compress, max_bytes, channel_label=False) as writer:
             for msg in messages:
-                author_name = get_registered_alias(msg.author)
-                log_file.write(f'{author_name}: {msg.content}\n')
+                writer.write(msg.created_at, msg.channel.name, None, get_registered_alias(msg.author), msg.content, msg.id)
+        file_names = writer.paths
 
-        await message.channel.send(f'Logged {len(messages)} messages to {file_name}')
+        await message.channel.send(f'Logged {len(messages)} messages to {", ".join(file_names)}')
+        for file_name in file_names:
+            try:
+                await message.channel.send(file=discord.File(file_name))
+            except discord.HTTPException as e:
+                await message.channel.send(f'Could not upload {file_name}: {e}')
 
     elif message.content.startswith('!register'):
         # Check if the command has the required number of arguments
@@ -3,6 +3,11 @@
 import discord
 from discord.ext import commands
 import os
+import sys
+# Role lines are parsed and applied by the same code as the server-manager bot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FUNCTIONAL BOT THAT WORKS WELL'))
+from server_plan import parse_role
+from bulk_ops import BulkExecutor
 
 intents = discord.Intents.default()
 intents.typing = False
@@ -11,13 +16,45 @@ intents.message_content = True
 
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+# Most role creations in flight at once
+ROLE_CONCURRENCY = 5
+# Times one role creation is retried after a rate limit or server error
+ROLE_MAX_RETRIES = 5
+
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
 
-@bot.command(name='create_roles', help='Creates roles based on the provided text file. Format: Role Name,color,permission1,...')
-async def create_roles(ctx):
+def compile_roles(lines):
+    """Parse roles.txt into DesiredRoles, collecting every error instead of stopping at the first."""
+    roles = []
+    errors = []
+    seen = set()
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        role = parse_role(line.strip().split(','), line_number, errors)
+        if role.name and role.name in seen:
+            errors.append(f"Line {line_number}: duplicate role {role.name}")
+        seen.add(role.name)
+        roles.append(role)
+    return roles, errors
+
+async def send_lines(ctx, lines):
+    # Sends lines in as few messages as fit under Discord's 2000 character limit
+    chunk = ""
+    for line in lines:
+        if chunk and len(chunk) + len(line) + 1 > 2000:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(chunk)
+
+@bot.command(name='create_roles', help='Creates roles based on the provided text file. Format: Role Name,color,permission1,... '
+                                       'Existing roles are updated; use "!create_roles skip" to leave them untouched')
+async def create_roles(ctx, existing: str = 'update'):
     if not ctx.message.author.guild_permissions.manage_roles:
         await ctx.send("You do not have permission to use this command.")
         return
@@ -26,24 +63,47 @@ async def create_roles(ctx):
         await ctx.send("Could not find roles.txt file.")
         return
 
+    # Validate the whole file before touching the server, so a bad line never leaves a partial role set
     with open('roles.txt', 'r') as file:
-        for line in file:
-            role_info = line.strip().split(',')
-            role_name = role_info[0].strip()
-            # Default color is 0 (no color) if not specified or invalid
-            color = discord.Colour(int(role_info[1].strip(), 16)) if len(role_info) > 1 and role_info[1].strip() else 0
-            permissions = discord.Permissions()
-
-            for perm in role_info[2:]:
-                perm = perm.strip()
-                if hasattr(permissions, perm):
-                    setattr(permissions, perm, True)
-                else:
-                    await ctx.send(f"Invalid permission: {perm}")
-                    return
-
-            await ctx.guild.create_role(name=role_name, color=color, permissions=permissions)
-
-    await ctx.send("Roles created successfully!")
+        roles, errors = compile_roles(file)
+    if errors:
+        await send_lines(ctx, [f"roles.txt has {len(errors)} errors, no roles were created:"] + errors)
+        return
+
+    existing_roles = {role.name: role for role in ctx.guild.roles}
+    executor = BulkExecutor(concurrency=ROLE_CONCURRENCY, max_retries=ROLE_MAX_RETRIES)
+
+    def create(role):
+        return lambda results: ctx.guild.create_role(name=role.name, color=role.color, permissions=role.permissions)
+
+    def update(current, role):
+        return lambda results: current.edit(color=role.color, permissions=role.permissions)
+
+    for role in roles:
+        current = existing_roles.get(role.name)
+        if current is None:
+            executor.add(('create', role.name), 'create_role', role.name, create(role))
+        elif existing != 'skip' and (current.color != role.color or current.permissions.value != role.permissions.value):
+            executor.add(('update', role.name), 'edit_role', role.name, update(current, role))
+    await executor.run()
+
+    created = [executor.results[('create', role.name)] for role in roles if ('create', role.name) in executor.results]
+    updated = sum(1 for role in roles if ('update', role.name) in executor.results)
+    failures = [f"{name}: {error}" for name, error in executor.failed]
+    unchanged = len(roles) - len(created) - updated - len(failures)
+
+    # New roles go to the bottom of the hierarchy in file order, first line highest, in one request
+    if created:
+        positions = {role: len(created) - index for index, role in enumerate(created)}
+        try:
+            await ctx.guild.edit_role_positions(positions=positions)
+        except discord.HTTPException as e:
+            failures.append(f"ordering roles: {e}")
+
+    summary = f"Roles created: {len(created)}, updated: {updated}, unchanged or skipped: {unchanged}."
+    if failures:
+        await send_lines(ctx, [summary, "Failed:"] + failures)
+    else:
+        await ctx.send(f"Roles created successfully! {summary}")
 
 bot.run("MTIwMjgyMTIwODYyMjc2NDA1Mg.GsUQlT.05tpuBRg40g1BivPStaktUDm3E3OOC_JJ5EaK4")
\ No newline at end of file
@@ -1,6 +1,9 @@
 import discord
 import os
-
+import sys
+# API calls are scheduled by the server-manager bot's bulk executor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FUNCTIONAL BOT THAT WORKS WELL'))
+from bulk_ops import BulkExecutor
 
 
 intents = discord.Intents.default()  # Use default intents for general use cases
@@ -21,37 +24,66 @@ async def on_message(message):
 
     if message.content.lower() == "setup server":
         try:
+            # Parse the whole file first: each category with its channels in file order
+            layout = []
             with open("input.txt", "r") as file:
-                category = None
                 for line in file:
                     line = line.strip()
                     if line.startswith("{") and line.endswith("}"):
-                        category_name = line[1:-1]
-                        category = await message.guild.create_category(category_name)
-                    elif line.startswith("[") and line.endswith("]") and category is not None:
+                        layout.append((line[1:-1], []))
+                    elif line.startswith("[") and line.endswith("]") and layout:
                         # Added error handling for split
                         try:
                             name, *optional_topic = line[1:-1].split("|")
                             topic = optional_topic[0] if optional_topic else ""
-                            await message.guild.create_text_channel(name, category=category, topic=topic)
+                            layout[-1][1].append((name, topic))
                         except ValueError as e:
                             print(f"Error processing line '{line}': {e}")
-            await message.channel.send("Server setup complete!")
+
+            # Categories are created concurrently, each one's channels as soon as it exists;
+            # explicit positions keep the file's order
+            executor = BulkExecutor()
+
+            def create_category(name, position):
+                return lambda results: message.guild.create_category(name, position=position)
+
+            def create_channel(category_key, name, topic, position):
+                return lambda results: message.guild.create_text_channel(
+                    name, category=results[category_key], topic=topic, position=position)
+
+            position = 0
+            for category_index, (category_name, channels) in enumerate(layout):
+                category_key = f"category:{category_index}"
+                executor.add(category_key, "create_channel", f"category {category_name}",
+                             create_category(category_name, position))
+                for index, (name, topic) in enumerate(channels, 1):
+                    executor.add(f"{category_key}:channel:{index}", "create_channel", f"channel {name}",
+                                 create_channel(category_key, name, topic, position + index), depends_on=[category_key])
+                position += len(channels) + 1
+            await executor.run()
+            await message.channel.send("Server setup finished. " + executor.summary("Created"))
         except Exception as e:
             await message.channel.send(f"An error occurred: {e}")
             print(f"An error occurred: {e}")
 
     elif message.content.lower() == "purge":
+        # The channel the command came from is deleted too, so the result goes to the invoker's DMs
         try:
-            for category in list(message.guild.categories):
-                await category.delete()
-            for channel in list(message.guild.channels):
-                if isinstance(channel, discord.TextChannel):
-                    await channel.delete()
-            await message.channel.send("Server purge complete!")
+            executor = BulkExecutor()
+            targets = list(message.guild.categories) + [
+                channel for channel in message.guild.channels if isinstance(channel, discord.TextChannel)
+            ]
+            for target in targets:
+                executor.add(target.id, "delete_channel", target.name, lambda results, target=target: target.delete())
+            await executor.run()
+            result = "Server purge finished. " + executor.summary("Deleted")
         except Exception as e:
-            await message.channel.send(f"An error occurred during purge: {e}")
-            print(f"An error occurred during purge: {e}")
+            result = f"An error occurred during purge: {e}"
+        print(result)
+        try:
+            await message.author.send(result)
+        except discord.HTTPException as e:
+            print(f"Could not send the purge result to {message.author}: {e}")
 
 # Start the bot with the token
 client.run("MTIzNzIwNzY0MTM5OTQ5Njc1NQ.GeJ5FH.8M0YTf7YA9oBvf1XJcf6J0MTyDhim73OObJQu0")